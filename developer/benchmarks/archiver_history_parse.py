@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Benchmark: parsing a getData.json archiver history response in full (json.loads)
+vs streamed into growable arrays, time and peak memory.
+
+Usage:
+    python developer/benchmarks/archiver_history_parse.py [n_samples ...]
+
+Responses are synthetic, with samples as returned by the appliance.
+Peak memory is measured with tracemalloc, which slows both methods down,
+so times are measured separately.
+"""
+from lcls_live.archiver import sample_arrays, stream_sample_arrays, _raw_decode_samples
+import json
+import sys
+import time
+import tracemalloc
+
+CHUNK_SIZE = 65536
+
+
+def response(n):
+    samples = [{'secs': 1600000000 + i // 120, 'nanos': (i % 120) * 8333333, 'val': i * 0.001,
+                'severity': 0, 'status': 0} for i in range(n)]
+    return json.dumps([{'meta': {'name': 'BPMS:LI24:801:X', 'PREC': '3'}, 'data': samples}]).encode()
+
+
+def parse_full(text):
+    data = json.loads(text)
+    return sample_arrays(data[0]['data'])
+
+
+def parse_stream(text):
+    chunks = (text[i:i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE))
+    return stream_sample_arrays(_raw_decode_samples(chunks))
+
+
+def measure(f, text):
+    t0 = time.perf_counter()
+    f(text)
+    t = time.perf_counter() - t0
+    tracemalloc.start()
+    f(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return t, peak
+
+
+def main(sizes):
+    print(f'{"samples":>9} {"text (MB)":>10} {"full (s)":>9} {"full (MB)":>10} {"stream (s)":>11} {"stream (MB)":>12}')
+    for n in sizes:
+        text = response(n)
+        t_full, m_full = measure(parse_full, text)
+        t_stream, m_stream = measure(parse_stream, text)
+        print(f'{n:9} {len(text)/1e6:10.1f} {t_full:9.2f} {m_full/1e6:10.1f} {t_stream:11.2f} {m_stream/1e6:12.1f}')
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [100_000, 1_000_000])
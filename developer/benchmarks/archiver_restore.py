@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Benchmark: archiver restore of a full beampath PV list, in one request vs
+concurrent chunks, against a local mock Archiver Appliance.
+
+Usage:
+    python developer/benchmarks/archiver_restore.py [beampath ...]
+
+The mock answers getDataAtTime after a fixed latency plus a time per PV,
+handling each request sequentially, as the appliance looks up each PV.
+Its parameters are set below.
+"""
+from lcls_live.archiver import ArchiverClient
+from lcls_live.datamaps import get_datamaps, DatamapPlan
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import sys
+import threading
+import time
+
+# Mock appliance: seconds per request, and per PV
+LATENCY = 0.02
+TIME_PER_PV = 0.0005
+
+CHUNK_SIZES = [None, 1000, 500, 200, 100]
+
+
+class MockAppliance(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        pvnames = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(LATENCY + TIME_PER_PV * len(pvnames))
+        body = json.dumps({pvname: {'secs': 1600000000, 'nanos': 0, 'val': 1.0} for pvname in pvnames}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def best_time(f, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main(beampaths):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockAppliance)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/retrieval/data'
+
+    print(f'Mock appliance: {LATENCY*1e3:.0f} ms per request + {TIME_PER_PV*1e3:.2f} ms per PV')
+    print(f'{"beampath":10} {"PVs":>6} {"chunk":>6} {"time (s)":>9} {"speedup":>8}')
+    with ArchiverClient(url, verbose=False) as client:
+        for beampath in beampaths:
+            pvlist = DatamapPlan(get_datamaps(beampath)).pvlist
+            t_single = None
+            for chunk_size in CHUNK_SIZES:
+                t = best_time(lambda: client.restore(pvlist, '2022-03-06T15:21:15.000000-08:00',
+                                                     chunk_size=chunk_size or len(pvlist)))
+                t_single = t_single or t
+                print(f'{beampath:10} {len(pvlist):6} {chunk_size or "all":>6} {t:9.3f} {t_single/t:8.1f}x')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or ['sc_hxr', 'cu_hxr'])
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Benchmark: datamap load time from datamaps_master.json vs compiled bundles.
+
+Usage:
+    python developer/benchmarks/datamap_load.py [beampath ...]
+
+Bundles are built with:
+    from lcls_live.datamaps import build_bundles
+    build_bundles()
+"""
+import lcls_live.datamaps as datamaps
+from lcls_live.datamaps import bundle, master
+import json
+import pandas as pd
+import sys
+import timeit
+from io import StringIO
+
+
+def load_json(config_name):
+    # The pre-bundle path: JSON string inside JSON, then pd.read_json
+    specs = []
+    for dm in master.load_config(config_name):
+        d = json.loads(dm['data'])
+        if dm['class'] == 'tabular':
+            d['data'] = pd.read_json(StringIO(d['data']))
+        specs.append((dm['name'], dm['class'], d))
+    return specs
+
+
+def load_bundle(config_name):
+    specs = bundle.load_bundle(config_name)
+    assert specs is not None, f'No up to date bundle for {config_name}. Run build_bundles()'
+    return specs
+
+
+def best_time(f, *args, number=5, repeat=5):
+    return min(timeit.repeat(lambda: f(*args), number=number, repeat=repeat)) / number
+
+
+def main(config_names):
+    print(f'{"beampath":10} {"json (ms)":>10} {"bundle (ms)":>12} {"speedup":>8}')
+    for name in config_names:
+        t_json = best_time(load_json, name)
+        t_bundle = best_time(load_bundle, name)
+        print(f'{name:10} {t_json*1e3:10.2f} {t_bundle*1e3:12.2f} {t_json/t_bundle:8.1f}x')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or datamaps.available_configs())
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Benchmark: epics_proxy snapshot load time from JSON vs binary .npz snapshots.
+
+Usage:
+    python developer/benchmarks/snapshot_load.py [snapshot.json ...]
+
+Each JSON snapshot is converted to .npz in a temporary directory.
+"""
+from lcls_live.snapshot import save_snapshot, load_snapshot, read_snapshot_arrays
+import glob
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+DEFAULT_SNAPSHOTS = glob.glob(os.path.join(os.path.dirname(__file__), '../../docs/examples/data/epics_snapshot_*.json'))
+
+
+def best_time(f, *args, number=5, repeat=5):
+    return min(timeit.repeat(lambda: f(*args), number=number, repeat=repeat)) / number
+
+
+def load_json(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def main(filenames):
+    print(f'{"snapshot":40} {"PVs":>6} {"json (ms)":>10} {"npz (ms)":>9} {"mmap (ms)":>10} {"arrays (ms)":>12}')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for filename in filenames:
+            pvdata = load_json(filename)
+            npz = os.path.join(tmpdir, 'snapshot.npz')
+            save_snapshot(pvdata, npz)
+
+            t_json = best_time(load_json, filename)
+            t_npz = best_time(load_snapshot, npz)
+            t_mmap = best_time(lambda: load_snapshot(npz, mmap=True))
+            t_arrays = best_time(read_snapshot_arrays, npz)
+            name = os.path.basename(filename)[:40]
+            print(f'{name:40} {len(pvdata):6} {t_json*1e3:10.2f} {t_npz*1e3:9.2f} {t_mmap*1e3:10.2f} {t_arrays*1e3:12.2f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or DEFAULT_SNAPSHOTS)
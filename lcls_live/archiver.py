@@ -1,41 +1,582 @@
 #!/usr/bin/env python
 
+from lcls_live.history_cache import HistoryCache
+
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+import numpy as np
 import pandas as pd
+import codecs
+import datetime
+import json
+import os
+import re
+import threading
 
+try:
+    # Optional, for streaming history responses. See stream_samples.
+    import ijson
+except ImportError:
+    ijson = None
 
 
-def lcls_archiver_restore(pvlist, isotime='2018-08-11T10:40:00.000-07:00', verbose=True):
+
+# Retrieval URL of the LCLS EPICS Archiver Appliance
+ARCHIVER_URL = "http://lcls-archapp.slac.stanford.edu/retrieval/data"
+
+
+def sample_arrays(samples):
     """
-    Returns a dict of {'pvname':val} given a list of pvnames, at a time in ISO 8601 format, using the EPICS Archiver Appliance:
+    Returns secs, vals arrays from a list of archiver samples (dicts with secs, nanos, val).
+    
+    secs are float UNIX timestamps, including nanoseconds. 
+    Waveform vals are returned as an object array of arrays.
+    """
+    n = len(samples)
+    secs = np.fromiter(map(itemgetter('secs'), samples), dtype=np.float64, count=n)
+    if n and 'nanos' in samples[0]:
+        secs += np.fromiter(map(itemgetter('nanos'), samples), dtype=np.float64, count=n) * 1e-9
+    try:
+        return secs, np.fromiter(map(itemgetter('val'), samples), dtype=np.float64, count=n)
+    except (TypeError, ValueError):
+        pass
+    # Waveforms or strings
+    items = list(map(itemgetter('val'), samples))
+    try:
+        vals = np.asarray(items)
+    except ValueError:
+        # Waveforms of varying length
+        vals = None
+    if vals is None or vals.ndim > 1:
+        vals = np.empty(n, dtype=object)
+        for i, item in enumerate(items):
+            vals[i] = np.asarray(item)
+    return secs, vals
+
+
+class GrowableArray:
+    """
+    1-d numpy array that can be extended, doubling its capacity as needed.
+    The dtype becomes object if extended with incompatible values.
+    """
+    def __init__(self, dtype=np.float64, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+        
+    def __len__(self):
+        return self.size
+        
+    def extend(self, values):
+        values = np.asarray(values)
+        if not np.can_cast(values.dtype, self._data.dtype, casting='same_kind'):
+            self._data = self._data.astype(object)
+        n = self.size + len(values)
+        if n > len(self._data):
+            data = np.empty(max(n, 2 * len(self._data)), dtype=self._data.dtype)
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+        self._data[self.size:n] = values
+        self.size = n
+        
+    def array(self):
+        """
+        Returns the values, as a copy trimmed to size.
+        """
+        return self._data[:self.size].copy()
+
+
+# Start of the samples of a PV in a getData.json response
+_DATA_START = re.compile(r'"data"\s*:\s*\[')
+_WHITESPACE = re.compile(r'[\s,]*')
+
+
+def _raw_decode_samples(chunks):
+    # Yields samples from an iterable of bytes chunks of a getData.json response:
+    #   [{"meta": {...}, "data": [{"secs": ..., "val": ...}, ...]}, ...]
+    # Complete samples in the buffer are parsed together, and the text before
+    # the next sample is dropped. Near the ends of data arrays, or if a string
+    # value contains '}', samples are parsed one by one with JSONDecoder.raw_decode.
+    decoder = json.JSONDecoder()
+    bulk = True
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    in_data = False
+    eof = False
+    while True:
+        if in_data:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos < len(buf):
+                if buf[pos] == ']':
+                    in_data = False
+                    pos += 1
+                    continue
+                cut = buf.rfind('}', pos) + 1
+                if bulk and cut > pos:
+                    # Once per read
+                    bulk = False
+                    try:
+                        samples = json.loads('[' + buf[pos:cut] + ']')
+                    except json.JSONDecodeError:
+                        pass
+                    else:
+                        pos = cut
+                        yield from samples
+                        continue
+                try:
+                    sample, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # Incomplete sample: read more
+                    if eof:
+                        raise
+                else:
+                    pos = end
+                    yield sample
+                    continue
+        else:
+            match = _DATA_START.search(buf, pos)
+            if match:
+                in_data = True
+                pos = match.end()
+                continue
+            # Keep a possible partial '"data" :  [' at the end
+            pos = max(pos, len(buf) - 32)
+        if eof:
+            if in_data:
+                raise ValueError('Truncated archiver response')
+            return
+        buf = buf[pos:]
+        pos = 0
+        bulk = True
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buf += utf8.decode(b'', final=True)
+        else:
+            buf += utf8.decode(chunk)
+
+
+def stream_samples(response, chunk_size=65536):
+    """
+    Yields the samples of a streamed (stream=True) getData.json response,
+    parsing the response incrementally, so that its full text is never in memory.
+    
+    Uses ijson if it is installed, otherwise JSONDecoder.raw_decode.
+    """
+    if ijson is not None:
+        response.raw.decode_content = True
+        yield from ijson.items(response.raw, 'item.data.item', use_float=True)
+    else:
+        yield from _raw_decode_samples(response.iter_content(chunk_size=chunk_size))
+
+
+def stream_sample_arrays(samples, batch_size=4096):
+    """
+    Same as sample_arrays, but for an iterable of samples, such as stream_samples.
+    Samples are converted in batches of batch_size into growable arrays, 
+    so that memory stays proportional to the output arrays.
+    """
+    secs = GrowableArray(np.float64)
+    vals = None
+    samples = iter(samples)
+    while True:
+        batch = [sample for _, sample in zip(range(batch_size), samples)]
+        if not batch:
+            break
+        batch_secs, batch_vals = sample_arrays(batch)
+        if vals is None:
+            vals = GrowableArray(batch_vals.dtype if batch_vals.dtype.kind in 'fiub' else object)
+        secs.extend(batch_secs)
+        vals.extend(batch_vals)
+    if vals is None:
+        return secs.array(), np.zeros(0)
+    return secs.array(), vals.array()
+
+
+def to_secs(times):
+    """
+    Converts an ISO 8601 string, datetime, or array of them, to float UNIX timestamps.
+    Times without a timezone are taken as UTC.
+    """
+    if isinstance(times, str) or np.ndim(times) == 0:
+        t = pd.Timestamp(times)
+        if t.tz is None:
+            t = t.tz_localize('UTC')
+        return t.timestamp()
+    index = pd.DatetimeIndex(times)
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return np.asarray((index - pd.Timestamp(0)) / pd.Timedelta(seconds=1), dtype=np.float64)
+
+
+def to_isotime(secs):
+    """
+    Converts a UNIX timestamp to an ISO 8601 string, in UTC.
+    """
+    return datetime.datetime.fromtimestamp(secs, datetime.timezone.utc).isoformat(timespec='microseconds')
+
+
+def asof_align(secs, vals, grid, tolerance=None):
+    """
+    Returns the values of a time series (secs, vals) as of each time of grid:
+    the last value at or before that time, or NaN (None for non-numeric values) 
+    if there is none, or if it is older than tolerance seconds.
+    
+    secs must be sorted.
+    """
+    grid = np.asarray(grid, dtype=np.float64)
+    ix = np.searchsorted(secs, grid, side='right') - 1
+    ok = ix >= 0
+    if tolerance is not None and len(secs):
+        ok &= grid - secs[np.maximum(ix, 0)] <= tolerance
+    if vals.dtype.kind in 'fiub':
+        out = np.full(len(grid), np.nan)
+    else:
+        out = np.full(len(grid), None, dtype=object)
+    out[ok] = vals[ix[ok]]
+    return out
+
+
+class ArchiverClient:
+    """
+    Client for the EPICS Archiver Appliance retrieval service:
     
     https://slacmshankar.github.io/epicsarchiver_docs/userguide.html
     
+    Requests go through a single requests.Session, which keeps connections 
+    alive and reuses them, so that repeated calls do not pay for TCP setup
+    and proxy negotiation (for example through the SOCKS tunnel of 
+    configure-archiver-remote) every time. 
+    
+    Parameters
+    ----------
+    url : str, optional
+        Retrieval URL. Default: ARCHIVER_URL
+        
+    pool_maxsize : int, optional
+        Maximum number of connections kept open per host. Default: 10
+        
+    timeout : float or (float, float), optional
+        Connect and read timeouts in seconds, as in requests. Default: (10, 300)
+        
+    max_retries : int, optional
+        Retries of failed connections. Default: 2
+        
+    compress : bool, optional
+        Ask for gzip compressed responses. Default: True
+        
+    proxies : dict, optional
+        Proxies, as in requests. By default, the environmental variables
+        http_proxy, HTTPS_PROXY and ALL_PROXY are used.
+        
+    chunk_size : int, optional
+        restore requests PVs in chunks of this size, concurrently. Default: 500
+        None requests all PVs at once.
+        
+    max_workers : int, optional
+        Maximum number of concurrent requests. Default: pool_maxsize
+        
+    stream : bool, optional
+        Parse history responses incrementally, see history_arrays. Default: True
+        
+    cache : HistoryCache or str, optional
+        Cache of PV histories, or its directory. History requests then only fetch 
+        the time intervals that are not cached yet. See lcls_live.history_cache.
+        Default: None, or the directory in the environmental variable LCLS_LIVE_ARCHIVER_CACHE
+        for the default client of the module functions.
+        
+    verbose : bool, optional
+        Print requests. Default: True
+    
+    Example
+    -------
+        with ArchiverClient() as client:
+            for isotime in times:
+                pvdata = client.restore(pvlist, isotime)
     
     """
+    def __init__(self, url=ARCHIVER_URL, pool_maxsize=10, timeout=(10.0, 300.0), max_retries=2,
+                 compress=True, proxies=None, verbose=True, chunk_size=500, max_workers=None, stream=True,
+                 cache=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.verbose = verbose
+        self.pool_maxsize = pool_maxsize
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers or pool_maxsize
+        self.stream = stream
+        self.cache = HistoryCache(cache) if isinstance(cache, str) else cache
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=max_retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate' if compress else 'identity'
+        if proxies:
+            self.session.proxies.update(proxies)
+            
+        # Number of requests made
+        self.n_requests = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        
+        # PVs missing from the last restore
+        self.missing = []
+            
+    def __enter__(self):
+        return self
     
-    url="http://lcls-archapp.slac.stanford.edu/retrieval/data/getDataAtTime?at="+isotime+"&includeProxies=true"
-    headers = {'Content-Type':'application/json'}
+    def __exit__(self, *args):
+        self.close()
+        
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.session.close()
+        
+    def map(self, f, *iterables):
+        """
+        Returns the list of f(*args) for the args of iterables, 
+        run concurrently in the client's thread pool, in order. 
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, 
+                                                    thread_name_prefix='ArchiverClient')
+        return list(self._executor.map(f, *iterables))
+        
+    def _verbose(self, verbose):
+        return self.verbose if verbose is None else verbose
+    
+    def _request(self, method, endpoint, **kwargs):
+        with self._lock:
+            self.n_requests += 1
+        r = self.session.request(method, self.url + '/' + endpoint, timeout=self.timeout, **kwargs)
+        if not r.ok:
+            raise RuntimeError(f"Archiver request failed. Response was: {r.status_code} - {r.reason}")
+        return r
+        
+    def _restore_chunk(self, isotime, pvnames):
+        r = self._request('POST', 'getDataAtTime', 
+                          params={'at': isotime, 'includeProxies': 'true'}, json=pvnames)
+        return r.json()
+        
+    def restore(self, pvlist, isotime='2018-08-11T10:40:00.000-07:00', verbose=None, chunk_size=None):
+        """
+        Returns a dict of {'pvname':val} given a list of pvnames, at a time in ISO 8601 format.
+        
+        PVs are requested in chunks of chunk_size (default: .chunk_size), concurrently. 
+        PVs missing from the archiver are reported once, and listed in .missing.
+        """
+        verbose = self._verbose(verbose)
+        
+        # Each unique PV is only requested once
+        data = list(dict.fromkeys(pvlist))
+        chunk_size = chunk_size or self.chunk_size or len(data) or 1
+        chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        
+        if verbose:
+            url = f'{self.url}/getDataAtTime?at={isotime}&includeProxies=true'
+            if len(chunks) > 1:
+                url += f' ({len(data)} PVs in {len(chunks)} chunks)'
+            print('Requesting:', url)
+        
+        if len(chunks) > 1:
+            results = self.map(lambda chunk: self._restore_chunk(isotime, chunk), chunks)
+        else:
+            results = [self._restore_chunk(isotime, data)]
+        res = {}
+        for result in results:
+            res.update(result)
+            
+        d = {}
+        missing = []
+        for k in data:
+            if k not in res:
+                missing.append(k)
+            else:
+                d[k] = res[k]['val']
+        self.missing = missing
+        if missing and verbose:
+            print(f'Warning: {len(missing)} missing PVs:', ', '.join(missing))
+        return d
     
-    if verbose:
-        print('Requesting:', url)
+    def history(self, pvname, start='2018-08-11T10:40:00.000-07:00', end='2018-08-11T11:40:00.000-07:00', verbose=None,
+                stream=None):
+        """
+        Get time series data from a PV name pvname, with start and end times in ISO 8601 format.
+        
+        Returns tuple: 
+            secs, vals
+        where secs is the UNIX timestamp, seconds since January 1, 1970, and vals are the values at those times.
+        
+        With stream=True (default: .stream), the response is parsed as it is received. See history_arrays.
+        """
+        if self.cache is not None:
+            secs, vals = self.history_arrays(pvname, start=start, end=end, verbose=verbose, stream=stream)
+            # As returned by the archiver
+            return np.floor(secs).astype(int).tolist(), [v.tolist() if isinstance(v, np.ndarray) else v 
+                                                          for v in vals.tolist()]
+        secs = []
+        vals = []
+        for x in self._history_samples(pvname, start, end, verbose, stream):
+            secs.append(x['secs'])
+            vals.append(x['val'])
+        return secs, vals
     
-    data = pvlist
-    r = requests.post(url, headers=headers, json=data)
+    def _history_samples(self, pvname, start, end, verbose, stream):
+        # List of samples, or with streaming, a generator of them
+        if self._verbose(verbose):
+            print(f'{self.url}/getData.json?pv={pvname}&from={start}&to={end}')
+        params = {'pv': pvname, 'from': start, 'to': end}
+        if self.stream if stream is None else stream:
+            return self._stream_history(params)
+        data = self._request('GET', 'getData.json', params=params).json()
+        return data[0]['data'] if data else []
     
-    if not r.ok:
-        raise RuntimeError(f"Archiver request failed. Response was: {r.status_code} - {r.reason}")
+    def _stream_history(self, params):
+        with self._request('GET', 'getData.json', params=params, stream=True) as r:
+            yield from stream_samples(r)
     
+    def history_arrays(self, pvname, start='2018-08-11T10:40:00.000-07:00', end='2018-08-11T11:40:00.000-07:00', verbose=None,
+                       stream=None):
+        """
+        Same as history, but returns numpy arrays secs, vals. 
+        secs are float UNIX timestamps, including nanoseconds. See sample_arrays.
+        
+        With stream=True (default: .stream), the response is parsed as it is received, 
+        into growable arrays, so that peak memory is proportional to the arrays 
+        rather than to the JSON text. See stream_samples.
+        
+        With a .cache, only time intervals not cached yet are fetched.
+        """
+        if self.cache is not None:
+            return self._cached_history_arrays(pvname, start, end, verbose, stream)
+        return self._fetch_history_arrays(pvname, start, end, verbose, stream)
     
-    res = r.json()
-    d = {}
-    for k in pvlist:
-        if k not in res:
-            if verbose:
-                print('Warning: Missing PV:', k)
+    def _fetch_history_arrays(self, pvname, start, end, verbose, stream):
+        samples = self._history_samples(pvname, start, end, verbose, stream)
+        if isinstance(samples, list):
+            return sample_arrays(samples)
+        return stream_sample_arrays(samples)
+    
+    def _cached_history_arrays(self, pvname, start, end, verbose, stream):
+        cache = self.cache
+        t0, t1 = to_secs(start), to_secs(end)
+        gaps = cache.missing(pvname, t0, t1)
+        if not gaps:
+            cache.n_hits += 1
+            if self._verbose(verbose):
+                print(f'{pvname} from {start} to {end} from cache')
+        for g0, g1 in gaps:
+            secs, vals = self._fetch_history_arrays(pvname, to_isotime(g0), to_isotime(g1), verbose, stream)
+            cache.n_fetches += 1
+            if not cache.add(pvname, secs, vals, g0, g1):
+                # Values that cannot be cached, such as waveforms of varying length
+                return self._fetch_history_arrays(pvname, start, end, verbose, stream)
+        secs, vals = cache.get(pvname, t0, t1)
+        if vals.ndim > 1:
+            rows = vals
+            vals = np.empty(len(rows), dtype=object)
+            vals[:] = list(rows)
+        return secs, vals
+    
+    def history_many(self, pvnames, start='2018-08-11T10:40:00.000-07:00', end='2018-08-11T11:40:00.000-07:00', 
+                     grid=None, tolerance=None, verbose=None):
+        """
+        Gets the histories of many PVs concurrently, as a single dataframe 
+        with the time as the index, and a column for each PV.
+        
+        Parameters
+        ----------
+        pvnames : list of str
+        
+        start, end : str
+            Times in ISO 8601 format
+            
+        grid : float, str, or array of datetimes, optional
+            Common times to align all PVs to. A number of seconds or a 
+            pandas frequency string ('1s', '100ms') gives a regular grid 
+            from start to end. Each PV takes its last value at or before 
+            each grid time (as-of alignment, see asof_align).
+            Default: None, the union of all sample times, with NaN 
+            where a PV has no sample at that time.
+            
+        tolerance : float, optional
+            With a grid, values older than tolerance seconds are NaN.
+        
+        Returns
+        -------
+        pd.DataFrame
+        """
+        pvnames = list(dict.fromkeys(pvnames))
+        histories = self.map(lambda pvname: self.history_arrays(pvname, start=start, end=end, verbose=verbose), pvnames)
+        
+        if grid is None:
+            columns = {}
+            for pvname, (secs, vals) in zip(pvnames, histories):
+                ser = pd.Series(vals, index=pd.to_datetime(secs, unit='s'))
+                columns[pvname] = ser[~ser.index.duplicated(keep='last')]
+            df = pd.concat(columns, axis=1) if columns else pd.DataFrame()
+            df.index.name = 'time'
+            return df
+        
+        if isinstance(grid, (str, int, float)):
+            step = pd.Timedelta(grid).total_seconds() if isinstance(grid, str) else float(grid)
+            t0, t1 = to_secs(start), to_secs(end)
+            grid_secs = t0 + step * np.arange(int(np.floor((t1 - t0) / step)) + 1)
         else:
-            d[k] = res[k]['val']
-    return d
+            grid_secs = to_secs(grid)
+            
+        data = {pvname: asof_align(secs, vals, grid_secs, tolerance=tolerance) 
+                for pvname, (secs, vals) in zip(pvnames, histories)}
+        df = pd.DataFrame(data, index=pd.to_datetime(grid_secs, unit='s'))
+        df.index.name = 'time'
+        return df
+        
+    def history_dataframe(self, pvname, **kwargs):
+        """
+        Same as history, but returns a dataframe with the index as the time. 
+        """
+        secs, vals = self.history(pvname, **kwargs)
+        
+        # Get time series
+        ser = pd.to_datetime(pd.Series(secs), unit='s' )
+        df = pd.DataFrame({'time':ser, pvname:vals})
+        df = df.set_index('time')
+        
+        return df
+    
+    def __str__(self):
+        return f'Archiver client for {self.url}, {self.n_requests} requests'
+
+
+_default_client = None
+
+
+def default_client():
+    """
+    Returns the ArchiverClient shared by the module functions, creating it on first use.
+    """
+    global _default_client
+    if _default_client is None:
+        _default_client = ArchiverClient(cache=os.environ.get('LCLS_LIVE_ARCHIVER_CACHE'))
+    return _default_client
+
+
+def lcls_archiver_restore(pvlist, isotime='2018-08-11T10:40:00.000-07:00', verbose=True):
+    """
+    Returns a dict of {'pvname':val} given a list of pvnames, at a time in ISO 8601 format, using the EPICS Archiver Appliance:
+    
+    https://slacmshankar.github.io/epicsarchiver_docs/userguide.html
+    
+    See ArchiverClient.restore
+    """
+    return default_client().restore(pvlist, isotime=isotime, verbose=verbose)
 
 
 
@@ -55,34 +596,30 @@ def lcls_archiver_history(pvname, start='2018-08-11T10:40:00.000-07:00', end='20
     import datetime
     datetime.datetime.utcfromtimestamp(secs[0])
     
+    See ArchiverClient.history
     """
-    url="http://lcls-archapp.slac.stanford.edu/retrieval/data/getData.json?"
-    url += "pv="+pvname
-    url += "&from="+start
-    url += "&to="+end
-    #url += "&donotchunk"
-    #url="http://lcls-archapp.slac.stanford.edu/retrieval/data/getData.json?pv=VPIO:IN20:111:VRAW&donotchunk"
-    print(url)
-    r = requests.get(url)
-    data =  r.json()
-    secs = [x['secs'] for x in data[0]['data']]
-    vals = [x['val'] for x in data[0]['data']]
-    return secs, vals
+    return default_client().history(pvname, start=start, end=end, verbose=verbose)
+
+
+def lcls_archiver_history_many(pvnames, start='2018-08-11T10:40:00.000-07:00', end='2018-08-11T11:40:00.000-07:00', 
+                               grid=None, tolerance=None, verbose=True):
+    """
+    Get the time series of many PVs concurrently, with start and end times in ISO 8601 format, 
+    as a dataframe with the time as the index and a column for each PV.
+    With a grid (seconds, a pandas frequency string, or times), all PVs are aligned 
+    to common times, taking their last value at or before each time. 
+    
+    See ArchiverClient.history_many
+    """
+    return default_client().history_many(pvnames, start=start, end=end, grid=grid, 
+                                          tolerance=tolerance, verbose=verbose)
 
 
 def lcls_archiver_history_dataframe(pvname, **kwargs):
     """
     Same as lcls_archiver_history, but returns a dataframe with the index as the time. 
     """
-
-    secs, vals = lcls_archiver_history(pvname, **kwargs)
-    
-    # Get time series
-    ser = pd.to_datetime(pd.Series(secs), unit='s' )
-    df = pd.DataFrame({'time':ser, pvname:vals})
-    df = df.set_index('time')
-    
-    return df
+    return default_client().history_dataframe(pvname, **kwargs)
 
 
     
@@ -4,6 +4,7 @@ import argparse
 from lcls_live.epics import epics_proxy
 from lcls_live.archiver import lcls_archiver_restore
 from lcls_live.datamaps import get_datamaps
+from lcls_live.datamaps.plan import DatamapPlan
 import epics
 import yaml
 import sys
@@ -37,22 +38,12 @@ def get_tao_from_epics(datamaps: list, cmd_type: str) -> List[str]:
 
     epics_interface = epics_proxy(epics=epics)
 
-    cmds = []
+    plan = DatamapPlan(datamaps)
 
-    all_pvs = []
-    for dm in datamaps:
-        all_pvs += dm.pvlist
+    # Values are ordered as plan.pvlist
+    pvdata = epics_interface.caget_many(plan.pvlist)
 
-    pvdata = epics_interface.caget_many(all_pvs)
-
-    for dm in datamaps:
-        if cmd_type == "tao":
-            cmds += dm.as_tao(pvdata)
-        
-        elif cmd_type == "bmad":
-            cmds += dm.as_bmad(pvdata)
-
-    return cmds
+    return plan_cmds(plan, pvdata, cmd_type)
     
 
 def get_tao_from_archiver(datamaps: list, isotime:str, cmd_type: str):
@@ -75,22 +66,32 @@ def get_tao_from_archiver(datamaps: list, isotime:str, cmd_type: str):
         os.environ["ALL_PROXY"] = "socks5h://localhost:8080"
 
 
-    cmds = []
+    plan = DatamapPlan(datamaps)
 
-    all_pvs = []
-    for dm in datamaps:
-        all_pvs += dm.pvlist
+    pvdata = lcls_archiver_restore(plan.pvlist, isotime)
 
-    pvdata = lcls_archiver_restore(all_pvs, isotime)
+    return plan_cmds(plan, pvdata, cmd_type)
 
-    for _, dm in datamaps.items():
-        if cmd_type == "tao":
-            cmds += dm.as_tao(pvdata)
-        
-        elif cmd_type == "bmad":
-            cmds += dm.as_bmad(pvdata)
 
-    return cmds
+def plan_cmds(plan: DatamapPlan, pvdata, cmd_type: str) -> List[str]:
+    """ Generate commands from a compiled datamap plan.
+
+    Args:
+        plan (DatamapPlan): Compiled datamaps
+        pvdata (dict or list): PV values, as a dict or ordered as plan.pvlist
+        cmd_type (str): string indicating tao or bmad
+
+    Returns:
+        List of commands
+
+    """
+    if cmd_type == "tao":
+        return plan.as_tao(pvdata)
+
+    elif cmd_type == "bmad":
+        return plan.as_bmad(pvdata)
+
+    return []
 
 
 def get_cmds(source: str, beampath: str, cmd_type: str, isotime: str=None, denylist: Optional[List[str]]=[]):
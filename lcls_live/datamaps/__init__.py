@@ -1,20 +1,42 @@
-from .klystron import KlystronDataMap
+from .klystron import KlystronDataMap, KlystronFleetDataMap
 from .tabular import TabularDataMap
-from lcls_live import data_dir
+from .registry import PVRegistry
+from .plan import DatamapPlan
+from .delta import DeltaEmitter
+from .master import load_config, load_all, available_configs
+from .bundle import load_bundle, build_bundles
 import json
 import pandas as pd
-import os
 from typing import Union, List
 from io import StringIO
 
-# Parse all 
-with open(os.path.join(data_dir, 'datamaps_master.json'), "r") as f:
-     ALL_DATAMAPS = json.load(f)
 
+def __getattr__(name):
+    # ALL_DATAMAPS is parsed on first access only, see datamaps.master
+    if name == 'ALL_DATAMAPS':
+        return load_all()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def get_datamaps(config_name: str, use_des: Union[bool, List[str]] = False):
+
+# Process-level cache of built datamaps, keyed on (config_name, use_des, klystron_fleet)
+_CACHE = {}
+
+
+def clear_cache():
+    """ Clears the datamap cache used by get_datamaps.
+    """
+    _CACHE.clear()
+
+
+def get_datamaps(config_name: str, use_des: Union[bool, List[str]] = False, klystron_fleet: bool = False):
     """ Utility function for building data maps given a configuration file.
 
+    Datamaps are built once per process for each (config_name, use_des, klystron_fleet) and cached.
+    Every call returns new datamap objects, with their own copy of any .data,
+    so callers cannot modify the cached datamaps. See clear_cache().
+    With pandas Copy-on-Write, .data is shared with the cache until it is modified,
+    and the arrays extracted from it are reused.
+
     Args:
         config_name (str): Choice of beamline to generate datamaps for (currently 
                            cu_hxr, cu_sxr, sc_inj, sc_diag0, sc_bsyd, sc_hxr, or sc_sxr)
@@ -23,31 +45,92 @@ def get_datamaps(config_name: str, use_des: Union[bool, List[str]] = False):
                            If use_des is a bool, it will apply to all data maps.
                            If use_des is a list of strings, only the datamaps whose names
                            are in use_des will use DES instead of ACT.
+
+        klystron_fleet (bool, optional): If True, all klystron stations are combined
+                           into a single KlystronFleetDataMap named 'klystrons', 
+                           in place of the first station. Default: False
         
     Returns:
         dict of name:datamap
         
     """
+    if isinstance(use_des, bool):
+        key = (config_name, use_des, klystron_fleet)
+    else:
+        key = (config_name, tuple(sorted(use_des)), klystron_fleet)
+
+    if key not in _CACHE:
+        datamaps = build_datamaps(config_name, use_des, klystron_fleet=klystron_fleet)
+        for dm in datamaps.values():
+            if isinstance(dm, TabularDataMap):
+                dm._arrays()
+        _CACHE[key] = datamaps
+
+    return {name: dm.copy() for name, dm in _CACHE[key].items()}
+
 
-    # select configs for given line
-    config_dms = ALL_DATAMAPS[config_name]
+def build_datamaps(config_name: str, use_des: Union[bool, List[str]] = False, klystron_fleet: bool = False):
+    """ Builds new data maps for a beampath, without caching. 
+    
+    See get_datamaps for arguments.
+    """
     loaded_dms = {}
-    for dm in config_dms:
-        if dm["class"] == "tabular":
-            d = json.loads(dm["data"])
-            json_str = d.pop('data')
-            json_data = StringIO(json_str)
-            data = pd.read_json(json_data)
+    for name, dm_class, d in datamap_specs(config_name):
+        if dm_class == "tabular":
             # Handle cases where use_des applies
-            if dm["name"] in ("quad", "correctors", "solenoid", "quad_corrector", "subboosters", "cavities"):
-                if (use_des is True) or (use_des is not False and dm["name"] in use_des):
+            if name in ("quad", "correctors", "solenoid", "quad_corrector", "subboosters", "cavities"):
+                if (use_des is True) or (use_des is not False and name in use_des):
                     d["pvname"] = "pvname" #convention is: pvname is the DES PV, pvname_rbv is the ACT PV.
-            loaded = TabularDataMap(data=data, **d)
-        elif dm["class"] == "klystron":
+            loaded = TabularDataMap(**d)
+        elif dm_class == "klystron":
             use_des_for_klys = (use_des is True) or (use_des is not False and "klystron" in use_des)
-            loaded = KlystronDataMap.from_json(dm["data"], use_des=use_des_for_klys)
-        loaded_dms[dm["name"]] = loaded
+            loaded = KlystronDataMap(**d, use_des=use_des_for_klys)
+        loaded_dms[name] = loaded
+
+    if klystron_fleet:
+        loaded_dms = combine_klystrons(loaded_dms)
 
     return loaded_dms
 
 
+def combine_klystrons(datamaps: dict, name: str = "klystrons"):
+    """ Replaces the KlystronDataMaps in a dict of datamaps with a single 
+    KlystronFleetDataMap, at the position of the first station.
+
+    Returns:
+        dict of name:datamap
+    """
+    fleet = KlystronFleetDataMap.from_datamaps(datamaps)
+    if len(fleet) == 0:
+        return dict(datamaps)
+
+    combined = {}
+    for dm_name, dm in datamaps.items():
+        if isinstance(dm, KlystronDataMap):
+            if name not in combined:
+                combined[name] = fleet
+        else:
+            combined[dm_name] = dm
+    return combined
+
+
+def datamap_specs(config_name: str):
+    """ Returns the raw datamap specifications for a beampath.
+
+    Uses the compiled bundle when it is available and up to date,
+    otherwise parses this beampath's section of datamaps_master.json.
+
+    Returns:
+        list of (name, class, kwargs) 
+    """
+    specs = load_bundle(config_name)
+    if specs is not None:
+        return specs
+
+    specs = []
+    for dm in load_config(config_name):
+        d = json.loads(dm["data"])
+        if dm["class"] == "tabular":
+            d["data"] = pd.read_json(StringIO(d["data"]))
+        specs.append((dm["name"], dm["class"], d))
+    return specs
@@ -1,5 +1,6 @@
 from lcls_live.datamaps.tabular import TabularDataMap, datamap_from_tao_data
-from lcls_live.datamaps.klystron import KlystronDataMap, klystron_pvinfo, existing_LCLS_klystrons_sector_station, subbooster_pvinfo, SUBBOOSTER_SECTORS
+from lcls_live.datamaps.klystron import KlystronDataMap, klystron_pvinfo, subbooster_pvinfo, SUBBOOSTER_SECTORS
+from lcls_live.klystron import existing_LCLS_klystrons_sector_station
 
 
 
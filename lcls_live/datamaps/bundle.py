@@ -0,0 +1,117 @@
+"""
+Compiled datamap bundles.
+
+A bundle is one .npz file per beampath holding every datamap of that
+beampath as typed columnar arrays, so that loading needs no JSON parsing.
+Bundles are built from datamaps_master.json with build_bundles(),
+and are only used when they match the current master file.
+"""
+from lcls_live import data_dir
+from .master import master_index, load_config, section_bytes
+from .tabular import pack_dataframes, unpack_columns
+from .klystron import KlystronDataMap
+import dataclasses
+import hashlib
+import numpy as np
+import pandas as pd
+import json
+import os
+from io import StringIO
+
+BUNDLE_DIR = os.path.join(data_dir, 'bundles')
+BUNDLE_VERSION = 2
+
+# KlystronDataMap fields stored in a bundle. use_des is set at load time.
+KLYSTRON_FIELDS = [f.name for f in dataclasses.fields(KlystronDataMap) if f.name != 'use_des']
+
+
+def bundle_file(config_name, directory=BUNDLE_DIR):
+    return os.path.join(directory, f'{config_name}.npz')
+
+
+def _source_info(config_name):
+    # Identifies the content of the master file section that a bundle was built from
+    return {'sha1': hashlib.sha1(section_bytes(config_name)).hexdigest()}
+
+
+def build_bundle(config_name, directory=BUNDLE_DIR):
+    """
+    Compiles the datamaps of a single beampath from datamaps_master.json
+    into a .npz bundle. Returns the filename written.
+    """
+    frames = {}
+    maps = []
+    klystrons = []
+    for dm in load_config(config_name):
+        if dm['class'] == 'tabular':
+            d = json.loads(dm['data'])
+            key = f'tabular_{len(frames)}'
+            frames[key] = pd.read_json(StringIO(d.pop('data')))
+            maps.append({'name': dm['name'], 'class': 'tabular', 'frame': key, 'params': d})
+        elif dm['class'] == 'klystron':
+            maps.append({'name': dm['name'], 'class': 'klystron', 'row': len(klystrons)})
+            klystrons.append(json.loads(dm['data']))
+        else:
+            raise ValueError(f'Unknown datamap class: {dm["class"]}')
+
+    if klystrons:
+        frames['klystron'] = pd.DataFrame(klystrons, columns=KLYSTRON_FIELDS).fillna('')
+
+    layouts, pools = pack_dataframes(frames)
+    meta = {'version': BUNDLE_VERSION, 'source': _source_info(config_name),
+            'datamaps': maps, 'layouts': layouts}
+
+    os.makedirs(directory, exist_ok=True)
+    fname = bundle_file(config_name, directory)
+    np.savez(fname, __meta__=np.array(json.dumps(meta)), **pools)
+    return fname
+
+
+def build_bundles(config_names=None, directory=BUNDLE_DIR):
+    """
+    Compiles bundles for all beampaths (default) or a list of beampaths.
+    Returns the list of filenames written.
+    """
+    if config_names is None:
+        config_names = list(master_index())
+    return [build_bundle(name, directory=directory) for name in config_names]
+
+
+def load_bundle(config_name, directory=BUNDLE_DIR):
+    """
+    Loads the datamap specifications of a beampath from its bundle.
+
+    Returns a list of (name, class, kwargs) tuples, where kwargs
+    are the constructor arguments for TabularDataMap (including data)
+    or KlystronDataMap (excluding use_des).
+
+    Returns None if there is no bundle, or if it does not match
+    the current master file.
+    """
+    fname = bundle_file(config_name, directory)
+    if not os.path.exists(fname):
+        return None
+
+    with np.load(fname, allow_pickle=False) as npz:
+        pools = {k: npz[k] for k in npz.files}
+    meta = json.loads(pools.pop('__meta__').item())
+    if meta['version'] != BUNDLE_VERSION or meta['source'] != _source_info(config_name):
+        return None
+
+    frames = unpack_columns(meta['layouts'], pools)
+    if 'klystron' in frames:
+        # Klystron fields are only read row by row, so no DataFrame is needed
+        kcols = {field: frames['klystron'][0][field].tolist() for field in KLYSTRON_FIELDS}
+
+    specs = []
+    for m in meta['datamaps']:
+        if m['class'] == 'tabular':
+            data, index = frames[m['frame']]
+            kwargs = dict(m['params'])
+            kwargs['data'] = pd.DataFrame(data, index=index, copy=False)
+        else:
+            i = m['row']
+            kwargs = {field: kcols[field][i] for field in KLYSTRON_FIELDS}
+        specs.append((m['name'], m['class'], kwargs))
+
+    return specs
@@ -0,0 +1,142 @@
+from .plan import DatamapPlan
+from .tabular import emit_lines
+import numpy as np
+
+
+class DeltaEmitter:
+    """
+    Stateful command emitter for repeated refreshes.
+
+    Wraps a DatamapPlan and emits only the commands whose value has moved
+    beyond a deadband since it was last emitted. Every resync_every calls,
+    all commands are emitted.
+
+    Values are compared with the last *emitted* value, so slow drifts are
+    still emitted once they accumulate beyond the deadband.
+    A command whose PV becomes invalid emits its 'Bad value' line once,
+    and is emitted again when it becomes valid.
+
+    Parameters
+    ----------
+    datamaps : DatamapPlan, or dict of name:datamap, or list of datamaps
+        Datamaps to emit commands for. These are compiled into a DatamapPlan.
+
+    deadband : float, optional
+        Default absolute deadband. Default: 0, emit any change.
+
+    deadbands : dict, optional
+        Deadbands by datamap name or by attribute, for example:
+            {'bpms': 1e-6, 'phase_deg': 0.1}
+        Datamap names take precedence over attributes.
+
+    resync_every : int, optional
+        Emit all commands every resync_every calls. Default: 100.
+        None or 0 disables periodic resync.
+
+    cmd_type : str, optional
+        'tao' (default) or 'bmad'
+
+    Attributes
+    ----------
+    plan : DatamapPlan
+    deadband : np.ndarray
+        Deadband of each command in the plan
+    n_emitted : int
+        Number of commands emitted by the last call to emit
+
+    Example
+    -------
+        emitter = DeltaEmitter(get_datamaps('cu_hxr'), deadbands={'quad': 1e-4})
+        while True:
+            pvdata = epics_interface.caget_many(emitter.pvlist)
+            for cmd in emitter.emit(pvdata):
+                tao.cmd(cmd)
+
+    """
+    def __init__(self, datamaps, deadband=0.0, deadbands=None, resync_every=100, cmd_type='tao'):
+        if isinstance(datamaps, DatamapPlan):
+            self.plan = datamaps
+        else:
+            self.plan = DatamapPlan(datamaps)
+
+        if cmd_type == 'tao':
+            self._heads, self._tails = self.plan.tao_head, self.plan.tao_tail
+        elif cmd_type == 'bmad':
+            self._heads, self._tails = self.plan.bmad_head, self.plan.bmad_tail
+        else:
+            raise ValueError(f'Unknown cmd_type: {cmd_type}')
+        self.cmd_type = cmd_type
+        self.resync_every = resync_every
+
+        deadbands = deadbands or {}
+        self.deadband = np.array([
+            deadbands.get(name, deadbands.get(attribute, deadband))
+            for name, attribute in zip(self.plan.datamap, self.plan.attribute)], dtype=float)
+
+        self.reset()
+
+    @property
+    def pvlist(self):
+        return self.plan.pvlist
+
+    def reset(self):
+        """
+        Forgets all emitted values, so that the next call emits all commands.
+        """
+        n = len(self.plan)
+        self.last_value = np.full(n, np.nan)
+        self.last_valid = np.zeros(n, dtype=bool)
+        self.cycle = 0
+        self.n_emitted = 0
+
+    def changed(self, values, valid):
+        """
+        Returns the boolean mask of commands to emit, for evaluated values and valid.
+        """
+        if self.cycle == 0 or (self.resync_every and self.cycle % self.resync_every == 0):
+            return np.ones(len(values), dtype=bool)
+
+        never = np.isnan(self.last_value)
+        moved = np.abs(values - self.last_value) > self.deadband
+        return (valid != self.last_valid) | (valid & (moved | never))
+
+    def emit(self, pvdata):
+        """
+        Returns the list of commands that changed since they were last emitted.
+
+        pvdata can be a dict-like of pvname:value, or a sequence of values
+        ordered as .pvlist
+        """
+        values, valid = self.plan.evaluate(pvdata)
+        mask = self.changed(values, valid)
+        self.cycle += 1
+
+        ix = np.flatnonzero(mask)
+        self.n_emitted = len(ix)
+        self.last_value[ix] = np.where(valid[ix], values[ix], np.nan)
+        self.last_valid[ix] = valid[ix]
+
+        # Original values of the invalid commands emitted, by position in ix
+        bad = np.flatnonzero(~valid[ix])
+        bad_values = None
+        if len(bad):
+            bad_values = {bad[i]: value for i, value in self.plan._bad_values(pvdata, ix[bad]).items()}
+
+        if self.n_emitted == len(mask):
+            return emit_lines(self._heads, values, self._tails, valid, self.plan.bad_head,
+                              integer=self.plan.integer_cmd, bad_values=bad_values)
+
+        ix = ix.tolist()
+        return emit_lines([self._heads[i] for i in ix],
+                          values[ix],
+                          [self._tails[i] for i in ix],
+                          valid[ix],
+                          [self.plan.bad_head[i] for i in ix],
+                          integer=np.flatnonzero(self.plan.is_integer[ix]).tolist(),
+                          bad_values=bad_values)
+
+    def emit_text(self, pvdata):
+        """
+        Same as emit, but returns a single newline-joined string.
+        """
+        return '\n'.join(self.emit(pvdata))
@@ -1,4 +1,6 @@
-from lcls_live.klystron import all_fault_strings, unusable_faults, existing_LCLS_klystrons_sector_station
+from lcls_live.klystron import words_are_usable, swrd_unusable_mask, stat_unusable_mask, hdsc_unusable_mask, dsta1_unusable_mask, dsta2_unusable_mask
+from .tabular import values_as_float, emit_lines
+import copy
 import dataclasses
 import numpy as np
 import json
@@ -174,6 +176,9 @@ class KlystronDataMap:
     def asdict(self):
         return dataclasses.asdict(self)
     
+    def copy(self):
+        return dataclasses.replace(self)
+    
     
     @classmethod
     def from_json(cls, s, use_des=False):
@@ -202,6 +207,237 @@ class KlystronDataMap:
             return s    
     
         
+
+
+
+@dataclasses.dataclass
+class KlystronFleetDataMap:
+    """
+    All klystrons of a beampath in a single datamap.
+    
+    Station PVs are held as index arrays into .pvlist, so that 
+    enld, phase, and in_use are evaluated for all stations at once, 
+    with fault words decoded by bitwise operations.
+    
+    Attributes
+    ----------
+    klystrons : list[KlystronDataMap]
+        Stations, in the order that commands are emitted.
+    pvlist : list[str]
+        Unique PV names needed for evaluation. 
+        Scalar PVs come first, followed by n_waveform waveform PVs (DSTA).
+    
+    Methods
+    -------
+    evaluate(pvdata) :
+        Returns
+        -------
+        dict of:
+            enld : np.ndarray
+                energy gain in MeV
+            phase : np.ndarray
+                phase in deg
+            in_use : np.ndarray of bool
+    
+    as_bmad(pvdata)
+    as_tao(pvdata)
+        Returns
+        -------
+        list of str, with the same lines as each KlystronDataMap in turn.
+            
+    to_json(file=None)
+        Returns
+        -------
+            JSON string of a list of per-station dicts, or writes to file if given. 
+    
+    @classmethod
+    from_json(s, use_des=False):
+        Returns a new KlystronFleetDataMap from a JSON string or file 
+        of a list of per-station dicts, or a single station.
+    
+    pvdata can be a dict-like of pvname:value, or a sequence of values
+    ordered as .pvlist
+    
+    """
+    klystrons: list
+    
+    def __post_init__(self):
+        self.klystrons = list(self.klystrons)
+        scalar_pvs = []
+        waveform_pvs = []
+        pvs = {k: [] for k in ('ampl', 'phase', 'accel', 'swrd', 'stat', 'hdsc', 'dsta')}
+        for k in self.klystrons:
+            if k.use_des:
+                pvs['ampl'].append(k.ampl_des_pvname)
+                pvs['phase'].append(k.phase_des_pvname)
+            else:
+                pvs['ampl'].append(k.ampl_act_pvname)
+                pvs['phase'].append(k.phase_act_pvname)
+            pvs['accel'].append(k.accelerate_pvname)
+            for key in ('swrd', 'stat', 'hdsc', 'dsta'):
+                pvs[key].append(getattr(k, f'{key}_pvname') if k.has_fault_pvnames else '')
+            scalar_pvs += [pvs[key][-1] for key in ('ampl', 'phase', 'accel', 'swrd', 'stat', 'hdsc')]
+            waveform_pvs.append(pvs['dsta'][-1])
+        
+        scalar_pvs = list(dict.fromkeys(pv for pv in scalar_pvs if pv))
+        waveform_pvs = list(dict.fromkeys(pv for pv in waveform_pvs if pv))
+        self._pvlist = scalar_pvs + waveform_pvs
+        self.n_scalar = len(scalar_pvs)
+        self.n_waveform = len(waveform_pvs)
+        
+        # Index arrays. -1 for unused, which picks the NaN appended to scalar values.
+        # dsta indexes the waveforms.
+        index = {pv: i for i, pv in enumerate(self._pvlist)}
+        self._index = {}
+        for key, names in pvs.items():
+            ix = np.array([index[pv] if pv else -1 for pv in names], dtype=int)
+            if key == 'dsta':
+                ix[ix >= 0] -= self.n_scalar
+            self._index[key] = ix
+        
+        # Always disable mothballed 26-3 klystron.
+        self._disabled = np.array([k.sector == 26 and k.station == 3 for k in self.klystrons], dtype=bool)
+        
+        names = [k.bmad_name for k in self.klystrons]
+        attributes = ('ENLD_MeV', 'phase_deg', 'in_use')
+        self._tao_heads = [f'set ele {name} {a} = ' for name in names for a in attributes]
+        self._bmad_heads = [f'{name}[{a}] = ' for name in names for a in attributes]
+        self._bad_heads = [f'! Bad value for {name}[{a}]: ' for name in names for a in attributes]
+        self._tails = [''] * len(self._tao_heads)
+        self._integer = list(range(2, len(self._tao_heads), 3))
+    
+    @classmethod
+    def from_datamaps(cls, datamaps):
+        """
+        Creates a fleet from the KlystronDataMaps in a dict of name:datamap 
+        or list of datamaps. Other datamaps are ignored. 
+        """
+        if isinstance(datamaps, dict):
+            datamaps = datamaps.values()
+        return cls([dm for dm in datamaps if isinstance(dm, KlystronDataMap)])
+    
+    def __len__(self):
+        return len(self.klystrons)
+    
+    @property
+    def pvlist(self):
+        """
+        Returns a list of PV names needed for evaluation
+        """
+        return list(self._pvlist)
+    
+    @property
+    def bmad_names(self):
+        return [k.bmad_name for k in self.klystrons]
+    
+    def _gather(self, pvdata):
+        # Returns all PV values ordered as .pvlist
+        if hasattr(pvdata, 'get'):
+            return list(map(pvdata.get, self._pvlist))
+        if len(pvdata) != len(self._pvlist):
+            raise ValueError(f'Expected {len(self._pvlist)} values, got {len(pvdata)}')
+        return pvdata
+    
+    def is_usable(self, v, waveforms):
+        """
+        Returns a bool array of usable stations, from the scalar values v 
+        (float array ordered as .pvlist, with a trailing NaN) and the DSTA waveforms.
+        
+        Stations without fault PVs are usable. Missing fault words are unusable.
+        """
+        usable = np.ones(len(self), dtype=bool)
+        ix = np.flatnonzero(self._index['dsta'] >= 0)
+        if len(ix) == 0:
+            return usable
+        
+        words = np.stack([v[self._index[key][ix]] for key in ('swrd', 'stat', 'hdsc')])
+        dsta = np.array([_dsta_words(waveforms[j]) for j in self._index['dsta'][ix]], dtype=float).reshape(-1, 2).T
+        words = np.concatenate([words, dsta])
+        ok = ~np.isnan(words).any(axis=0)
+        swrd, stat, hdsc, dsta1, dsta2 = np.where(ok, words, 0).astype(np.int64)
+        
+        faulted = (swrd & swrd_unusable_mask) | (stat & stat_unusable_mask) | (hdsc & hdsc_unusable_mask) \
+                | (dsta1 & dsta1_unusable_mask) | (dsta2 & dsta2_unusable_mask)
+        usable[ix] = ok & (faulted == 0)
+        return usable
+    
+    def evaluate(self, pvdata):
+        """
+        Returns a dict of arrays: enld, phase, in_use evaluated from pvdata. 
+        """
+        allvals = self._gather(pvdata)
+        v = np.append(values_as_float(allvals[:self.n_scalar]), np.nan)
+        waveforms = allvals[self.n_scalar:]
+        
+        enld = np.nan_to_num(v[self._index['ampl']], nan=0.0)
+        phase = np.nan_to_num(v[self._index['phase']], nan=0.0)
+        
+        accel = self._index['accel']
+        is_accelerating = np.where(accel >= 0, v[accel] == 1, ~self._disabled)
+        in_use = is_accelerating & self.is_usable(v, waveforms)
+        
+        return dict(enld=enld, phase=phase, in_use=in_use)
+    
+    def _values(self, pvdata):
+        # Interleaved values of the ENLD_MeV, phase_deg, in_use commands of each station
+        dat = self.evaluate(pvdata)
+        values = np.empty(3*len(self))
+        values[0::3] = dat['enld']
+        values[1::3] = dat['phase']
+        values[2::3] = dat['in_use']
+        return values
+    
+    def _lines(self, pvdata, heads):
+        values = self._values(pvdata)
+        valid = np.ones(len(values), dtype=bool)
+        return emit_lines(heads, values, self._tails, valid, self._bad_heads, integer=self._integer)
+    
+    def as_bmad(self, pvdata):
+        return self._lines(pvdata, self._bmad_heads)
+    
+    def as_tao(self, pvdata):
+        return self._lines(pvdata, self._tao_heads)
+    
+    def copy(self):
+        # The index arrays only depend on the stations, which are copied unchanged
+        new = copy.copy(self)
+        new.klystrons = [k.copy() for k in self.klystrons]
+        return new
+    
+    @classmethod
+    def from_json(cls, s, use_des=False):
+        """
+        Creates a new KlystronFleetDataMap from a JSON string or file.
+        
+        This can be a list of per-station dicts, as written by .to_json, 
+        or a single station, as written by KlystronDataMap.to_json 
+        """
+        if os.path.exists(s):
+            d = json.load(open(s))
+        else:
+            d = json.loads(s)
+        if isinstance(d, dict):
+            d = [d]
+        return cls([KlystronDataMap(**k, use_des=use_des) for k in d])
+    
+    def to_json(self, file=None):
+        """
+        Returns a JSON string of the list of per-station dicts
+        """
+        d = [json.loads(k.to_json()) for k in self.klystrons]
+        if file:
+            with open(file, 'w') as f:
+                json.dump(d, f)
+        else:
+            return json.dumps(d)
+        
+    
+def _dsta_words(dsta):
+    # The two DSTA status words, or NaNs if missing
+    if dsta is None:
+        return (np.nan, np.nan)
+    return (dsta[0], dsta[1])
+
     
 def klystron_pvinfo(sector, station, beamcode=1):
     """
@@ -356,13 +592,9 @@ def klystron_is_usable(swrd=0, stat=0, hdsc=0, dsta=0):
     if dsta is None:
         return False
     
-    swrd = int(swrd)
-    stat = int(stat)
-    hdsc = int(hdsc)
-    dsta = list(map(int, dsta))
-    
-    fault_strings = all_fault_strings(swrd=swrd, stat=stat, hdsc=hdsc, dsta=dsta)
-    return set(fault_strings).isdisjoint(unusable_faults)    
+    # Bitmask check, equivalent to: 
+    # set(all_fault_strings(swrd=swrd, stat=stat, hdsc=hdsc, dsta=dsta)).isdisjoint(unusable_faults)
+    return words_are_usable(swrd=swrd, stat=stat, hdsc=hdsc, dsta=dsta)
 
 
 
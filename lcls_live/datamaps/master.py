@@ -0,0 +1,144 @@
+"""
+Lazy access to the sections of datamaps_master.json.
+
+The master file is a single JSON object of beampath:list-of-datamaps.
+A small index of byte offsets, datamaps_master_index.json, allows one
+beampath to be read and parsed without touching the others.
+"""
+from lcls_live import data_dir
+import hashlib
+import json
+import os
+
+MASTER_FILE = os.path.join(data_dir, 'datamaps_master.json')
+INDEX_FILE = os.path.join(data_dir, 'datamaps_master_index.json')
+
+# Parsed sections, by beampath
+_SECTIONS = {}
+
+# Index of beampath: (offset, length) in bytes
+_INDEX = None
+
+
+def build_master_index(master_file=MASTER_FILE):
+    """
+    Scans a datamaps master JSON file and returns an index dict with:
+        source_size : int
+            size of the master file in bytes
+        source_sha1 : str
+            SHA-1 hex digest of the master file
+        sections : dict of beampath:[offset, length]
+            byte offset and length of each beampath's JSON value
+
+    This parses the whole file once, so it is meant to be run when the
+    master file is (re)built, not at import.
+    """
+    with open(master_file, 'rb') as f:
+        raw = f.read()
+    text = raw.decode('utf-8')
+    decoder = json.JSONDecoder()
+
+    sections = {}
+    # Character offsets equal byte offsets for ASCII files (json.dump's default).
+    ascii_only = len(text) == len(raw)
+
+    def byte_offset(i):
+        return i if ascii_only else len(text[:i].encode('utf-8'))
+
+    i = _skip(text, 0)
+    if text[i] != '{':
+        raise ValueError(f'{master_file} does not contain a JSON object')
+    i = _skip(text, i + 1)
+    while text[i] != '}':
+        key, i = decoder.raw_decode(text, i)
+        i = _skip(text, i)
+        if text[i] != ':':
+            raise ValueError(f'Malformed JSON in {master_file} at character {i}')
+        start = _skip(text, i + 1)
+        _, end = decoder.raw_decode(text, start)
+        b0 = byte_offset(start)
+        sections[key] = [b0, byte_offset(end) - b0]
+        i = _skip(text, end)
+        if text[i] == ',':
+            i = _skip(text, i + 1)
+
+    return {'source_size': len(raw), 'source_sha1': hashlib.sha1(raw).hexdigest(), 'sections': sections}
+
+
+def write_master_index(master_file=MASTER_FILE, index_file=INDEX_FILE):
+    """
+    Builds and writes the byte offset index for a datamaps master file.
+    """
+    index = build_master_index(master_file)
+    with open(index_file, 'w') as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+def _skip(text, i):
+    # Skip JSON whitespace
+    while text[i] in ' \t\n\r':
+        i += 1
+    return i
+
+
+def master_index():
+    """
+    Returns the dict of beampath:(offset, length) for the master file.
+
+    Uses the shipped index when it matches the master file (same size
+    and SHA-1 digest), otherwise rebuilds it in memory.
+    """
+    global _INDEX
+    if _INDEX is None:
+        index = None
+        if os.path.exists(INDEX_FILE):
+            with open(INDEX_FILE, 'r') as f:
+                index = json.load(f)
+            if index.get('source_size') != os.path.getsize(MASTER_FILE):
+                index = None
+            else:
+                with open(MASTER_FILE, 'rb') as f:
+                    if index.get('source_sha1') != hashlib.sha1(f.read()).hexdigest():
+                        index = None
+        if index is None:
+            index = build_master_index(MASTER_FILE)
+        _INDEX = {k: tuple(v) for k, v in index['sections'].items()}
+    return _INDEX
+
+
+def available_configs():
+    """
+    Returns the list of beampath names available in the master file.
+    """
+    return list(master_index())
+
+
+def load_config(config_name):
+    """
+    Returns the raw list of datamap dicts for a single beampath,
+    parsing only that beampath's section of the master file.
+    """
+    if config_name in _SECTIONS:
+        return _SECTIONS[config_name]
+
+    section = json.loads(section_bytes(config_name))
+    _SECTIONS[config_name] = section
+    return section
+
+
+def section_bytes(config_name):
+    """
+    Returns the raw JSON bytes of a single beampath's section of the master file.
+    """
+    offset, length = master_index()[config_name]
+    with open(MASTER_FILE, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def load_all():
+    """
+    Returns the full dict of beampath:list of datamap dicts.
+    """
+    return {name: load_config(name) for name in master_index()}
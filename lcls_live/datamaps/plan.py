@@ -0,0 +1,247 @@
+from .tabular import TabularDataMap, values_as_float, emit_lines
+from .klystron import KlystronDataMap, KlystronFleetDataMap
+from .registry import PVRegistry
+from collections.abc import Mapping
+import numpy as np
+
+
+class DatamapPlan:
+    """
+    A collection of datamaps compiled into flat arrays, so that all of the
+    Bmad/Tao assignments of a beampath are evaluated with a few numpy operations
+    instead of one Python call per datamap.
+
+    Commands are emitted in the same order as evaluating each datamap in turn.
+    Values are computed numerically, as factor*value + offset, rather than
+    written as expressions for Tao/Bmad to evaluate.
+
+    Parameters
+    ----------
+    datamaps : dict of name:datamap or list of datamaps
+        TabularDataMap, KlystronDataMap and KlystronFleetDataMap objects, as from get_datamaps
+
+    Attributes
+    ----------
+    pvlist : list[str]
+        Unique PV names needed for evaluation.
+        Scalar PVs come first, followed by n_waveform waveform PVs (klystron DSTA).
+    registry : PVRegistry
+        Registry of .pvlist, with the indices of each datamap's PVs
+    klystrons : KlystronFleetDataMap
+        All klystron stations, evaluated together
+    datamap, element, attribute : list
+        Datamap name (or position, if given a list), element and attribute of each command
+
+    Methods
+    -------
+    values(pvdata) :
+        Returns
+        -------
+        np.ndarray of the scalar PV values, ordered as .pvlist
+
+    evaluate(pvdata) :
+        Returns
+        -------
+        values : np.ndarray
+            value of each command
+        valid : np.ndarray of bool
+            False for commands whose PV value is missing
+
+    as_bmad(pvdata)
+    as_tao(pvdata)
+        Returns
+        -------
+        list of str
+
+    as_bmad_text(pvdata)
+    as_tao_text(pvdata)
+        Returns
+        -------
+        str of newline-separated commands
+
+    pvdata can be a dict-like of pvname:value, or a sequence of values
+    ordered as .pvlist (for example, from caget_many(plan.pvlist)).
+    """
+
+    def __init__(self, datamaps):
+        if not isinstance(datamaps, Mapping):
+            datamaps = dict(enumerate(datamaps))
+
+        # Commands
+        self.datamap = []
+        self.element = []
+        self.attribute = []
+        self.tao_head = []
+        self.tao_tail = []
+        self.bmad_head = []
+        self.bmad_tail = []
+        self.bad_head = []
+        self.is_integer = []
+
+        # Tabular PV names, in order of first use. Indices are assigned below.
+        scalar_pvs = []
+
+        tab_pv, tab_factor, tab_offset, tab_cmd = [], [], [], []
+        klystrons, klystron_cmd = [], []
+
+        for dm_name, dm in datamaps.items():
+            if isinstance(dm, TabularDataMap):
+                arrays = dm._arrays()
+                n = len(arrays['pvlist'])
+                tao_heads, tao_tails = dm._heads_tails(dm.tao_format)
+                bmad_heads, bmad_tails = dm._heads_tails(dm.bmad_format)
+
+                tab_cmd.extend(range(len(self), len(self) + n))
+                tab_pv.extend(arrays['pvlist'])
+                tab_factor.extend(arrays['factors'])
+                tab_offset.extend(arrays['offsets'])
+                scalar_pvs.extend(arrays['pvlist'])
+
+                self.datamap.extend([dm_name] * n)
+                self.element.extend(arrays['elements'])
+                self.attribute.extend(arrays['attributes'])
+                self.tao_head.extend(tao_heads)
+                self.tao_tail.extend(tao_tails)
+                self.bmad_head.extend(bmad_heads)
+                self.bmad_tail.extend(bmad_tails)
+                self.bad_head.extend(arrays['bad_heads'])
+                self.is_integer.extend([False] * n)
+
+            elif isinstance(dm, (KlystronDataMap, KlystronFleetDataMap)):
+                stations = dm.klystrons if isinstance(dm, KlystronFleetDataMap) else [dm]
+                for k in stations:
+                    klystrons.append(k)
+                    klystron_cmd.append(len(self))
+                    name = k.bmad_name
+                    for attribute in ('ENLD_MeV', 'phase_deg', 'in_use'):
+                        self._add_command(dm_name, name, attribute,
+                                          f'set ele {name} {attribute} = ', '',
+                                          f'{name}[{attribute}] = ', '',
+                                          is_integer=attribute == 'in_use')
+            else:
+                raise TypeError(f'Cannot compile datamap of type {type(dm)}')
+
+        # All stations are evaluated together
+        self.klystrons = KlystronFleetDataMap(klystrons)
+        self.klystron_cmd = np.array(klystron_cmd, dtype=int)
+        fleet_pvlist = self.klystrons.pvlist
+        scalar_pvs += fleet_pvlist[:self.klystrons.n_scalar]
+        waveform_pvs = fleet_pvlist[self.klystrons.n_scalar:]
+
+        # Scalar PVs first, then waveforms
+        self.registry = PVRegistry(scalar_pvs)
+        self.n_scalar = len(self.registry)
+        self.registry.intern_many(waveform_pvs)
+        self.n_waveform = len(self.registry) - self.n_scalar
+        for name, dm in datamaps.items():
+            self.registry.datamap_indices[name] = self.registry.indices(dm.pvlist)
+
+        self.tab_pv = self.registry.indices(tab_pv)
+        self.tab_factor = np.array(tab_factor, dtype=float)
+        self.tab_offset = np.array(tab_offset, dtype=float)
+        self.tab_cmd = np.array(tab_cmd, dtype=int)
+        # PV index of each command, -1 for klystrons
+        self.cmd_pv = np.full(len(self), -1, dtype=int)
+        self.cmd_pv[self.tab_cmd] = self.tab_pv
+        self.klystron_pv = self.registry.indices(fleet_pvlist).tolist()
+
+        self.is_integer = np.array(self.is_integer, dtype=bool)
+        self.integer_cmd = np.flatnonzero(self.is_integer).tolist()
+
+    @property
+    def pvlist(self):
+        return self.registry.pvlist
+
+    def _add_command(self, dm_name, element, attribute, tao_head, tao_tail, bmad_head, bmad_tail, is_integer=False):
+        self.datamap.append(dm_name)
+        self.element.append(element)
+        self.attribute.append(attribute)
+        self.tao_head.append(tao_head)
+        self.tao_tail.append(tao_tail)
+        self.bmad_head.append(bmad_head)
+        self.bmad_tail.append(bmad_tail)
+        self.bad_head.append(f'! Bad value for {element}[{attribute}]: ')
+        self.is_integer.append(is_integer)
+
+    def __len__(self):
+        # Number of commands
+        return len(self.element)
+
+    def _gather(self, pvdata):
+        # Returns the list of all PV values, ordered as .pvlist
+        if isinstance(pvdata, Mapping):
+            return self.registry.gather(pvdata)
+        if len(pvdata) != len(self.pvlist):
+            raise ValueError(f'Expected {len(self.pvlist)} values, got {len(pvdata)}')
+        return pvdata
+
+    def values(self, pvdata):
+        """
+        Returns the scalar PV values as a float array, ordered as .pvlist.
+        Missing values (None) are NaN.
+        """
+        return values_as_float(self._gather(pvdata)[:self.n_scalar])
+
+    def evaluate(self, pvdata):
+        """
+        Returns the arrays (values, valid) for all commands.
+        """
+        allvals = self._gather(pvdata)
+        v = self.values(allvals)
+        waveforms = allvals[self.n_scalar:]
+
+        values = np.zeros(len(self))
+        valid = np.ones(len(self), dtype=bool)
+
+        # Tabular
+        raw = v[self.tab_pv]
+        values[self.tab_cmd] = self.tab_factor * raw + self.tab_offset
+        valid[self.tab_cmd] = ~np.isnan(raw)
+
+        # Klystrons
+        if len(self.klystron_cmd) > 0:
+            dat = self.klystrons.evaluate([allvals[i] for i in self.klystron_pv])
+            values[self.klystron_cmd] = dat['enld']
+            values[self.klystron_cmd + 1] = dat['phase']
+            values[self.klystron_cmd + 2] = dat['in_use']
+
+        return values, valid
+
+    def _bad_values(self, pvdata, commands):
+        # Original PV values of commands, for their 'Bad value' lines
+        allvals = self._gather(pvdata)
+        return {i: allvals[self.cmd_pv[c]] for i, c in enumerate(commands) if self.cmd_pv[c] >= 0}
+
+    def _lines(self, pvdata, heads, tails):
+        values, valid = self.evaluate(pvdata)
+        bad = np.flatnonzero(~valid)
+        bad_values = None
+        if len(bad):
+            bad_values = {bad[i]: value for i, value in self._bad_values(pvdata, bad).items()}
+        return emit_lines(heads, values, tails, valid, self.bad_head, integer=self.integer_cmd,
+                          bad_values=bad_values)
+
+    def as_bmad(self, pvdata):
+        """
+        Return a list of strings to be read by Bmad's parser
+        """
+        return self._lines(pvdata, self.bmad_head, self.bmad_tail)
+
+    def as_tao(self, pvdata):
+        """
+        Return a list of Tao command strings
+        """
+        return self._lines(pvdata, self.tao_head, self.tao_tail)
+
+    def as_bmad_text(self, pvdata):
+        """
+        Same as as_bmad, but returns a single newline-joined string.
+        """
+        return '\n'.join(self.as_bmad(pvdata))
+
+    def as_tao_text(self, pvdata):
+        """
+        Same as as_tao, but returns a single newline-joined string.
+        """
+        return '\n'.join(self.as_tao(pvdata))
+
@@ -0,0 +1,114 @@
+from collections.abc import Mapping
+import numpy as np
+
+
+class PVRegistry:
+    """
+    Registry of unique PV names.
+
+    Each PV name is interned once and given an integer index into .pvlist,
+    so that a set of datamaps can fetch each PV once and look values up
+    by index rather than by name.
+
+    Parameters
+    ----------
+    pvnames : list[str], optional
+        Initial PV names to intern
+
+    Attributes
+    ----------
+    pvlist : list[str]
+        Unique PV names, in order of first registration
+    datamap_indices : dict of name:np.ndarray
+        Indices into .pvlist of each registered datamap's pvlist
+
+    Example
+    -------
+        registry = PVRegistry.from_datamaps(get_datamaps('cu_hxr'))
+        values = epics_interface.caget_many(registry.pvlist)
+        quad_values = registry.take(values, 'quad')
+
+    """
+    def __init__(self, pvnames=()):
+        self.pvlist = []
+        self._index = {}
+        self.datamap_indices = {}
+        self.intern_many(pvnames)
+
+    @classmethod
+    def from_datamaps(cls, datamaps):
+        """
+        Creates a registry from a dict of name:datamap, or list of datamaps.
+        Datamaps in a list are registered by their position.
+        """
+        if not isinstance(datamaps, Mapping):
+            datamaps = dict(enumerate(datamaps))
+        registry = cls()
+        for name, dm in datamaps.items():
+            registry.add_datamap(name, dm)
+        return registry
+
+    def __len__(self):
+        return len(self.pvlist)
+
+    def __contains__(self, pvname):
+        return pvname in self._index
+
+    def intern(self, pvname):
+        """
+        Returns the index of pvname, adding it if it is new.
+        """
+        ix = self._index.get(pvname)
+        if ix is None:
+            ix = len(self.pvlist)
+            self._index[pvname] = ix
+            self.pvlist.append(pvname)
+        return ix
+
+    def intern_many(self, pvnames):
+        """
+        Returns an integer array of the indices of pvnames, adding new ones.
+        """
+        return np.array([self.intern(pvname) for pvname in pvnames], dtype=int)
+
+    def index(self, pvname):
+        """
+        Returns the index of an already registered pvname.
+        Raises KeyError for unknown PVs.
+        """
+        return self._index[pvname]
+
+    def indices(self, pvnames):
+        """
+        Returns an integer array of the indices of already registered pvnames.
+        Raises KeyError for unknown PVs.
+        """
+        return np.array([self._index[pvname] for pvname in pvnames], dtype=int)
+
+    def add_datamap(self, name, datamap):
+        """
+        Registers the PVs of a datamap, and records its indices.
+        """
+        ix = self.intern_many(datamap.pvlist)
+        self.datamap_indices[name] = ix
+        return ix
+
+    def gather(self, pvdata):
+        """
+        Returns a list of values ordered as .pvlist from a dict-like pvdata.
+        Missing PVs are None.
+        """
+        return list(map(pvdata.get, self.pvlist))
+
+    def take(self, values, name):
+        """
+        Returns the values of a registered datamap's pvlist
+        from a sequence of values ordered as .pvlist.
+        """
+        return [values[i] for i in self.datamap_indices[name]]
+
+    def as_dict(self, values):
+        """
+        Returns a dict of pvname:value from values ordered as .pvlist
+        """
+        return dict(zip(self.pvlist, values))
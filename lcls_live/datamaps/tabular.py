@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 import json
 import os
+from io import StringIO
 
 @dataclasses.dataclass
 class TabularDataMap:
@@ -35,12 +36,12 @@ class TabularDataMap:
     evaluate(pvdata) :
         Returns
         -------
-        pd.Series
-            enld : float
-                energy gain in MeV
-            phase : float
-                phase in deg
-            in_use : bool
+        tuple of np.ndarray:
+            elements, attributes, vals, factors, offsets, valid_val
+            
+    The element, attribute, factor and offset arrays are extracted from .data
+    once and reused. They are recomputed if .data or a column name is replaced.
+    Call .invalidate() after modifying .data in place.
     
     """
     data : pd.DataFrame
@@ -59,41 +60,102 @@ class TabularDataMap:
         
     @property
     def pvlist(self):
-        return self.data[self.pvname].tolist()
-        
-    def evaluate(self, pvdata):
+        return list(self._arrays()['pvlist'])
+    
+    def __setattr__(self, name, value):
+        if name in _ARRAY_FIELDS:
+            self.__dict__.pop('_cache', None)
+        super().__setattr__(name, value)
+    
+    def invalidate(self):
         """
-        Extract values from pvdata
-        """        
-        vals = self.data[self.pvname].apply(pvdata.get)
-        
-        # Only set valid_val values
-        valid_val = ~vals.isnull()        
+        Discards the arrays extracted from .data. Call after modifying .data in place.
+        """
+        self.__dict__.pop('_cache', None)
+        self.__dict__.pop('_inherited', None)
+    
+    def _arrays(self):
+        """
+        Arrays extracted from .data, computed once and reused by evaluate.
+        Recomputed if .data or the column names are replaced, or after .invalidate().
+        """
+        cache = self.__dict__.get('_cache')
+        if cache is not None:
+            return cache
         
-        elements = self.data[self.element]
+        data = self.data
+        n = len(data)
+        arrays = {}
+        arrays['pvlist'] = tuple(data[self.pvname].tolist())
+        arrays['elements'] = data[self.element].to_numpy(dtype=object)
         
         if self.attribute:
-            attributes = self.data[self.attribute]        
+            arrays['attributes'] = data[self.attribute].to_numpy(dtype=object)
         else:
-            attributes = np.full(len(vals), '')
+            arrays['attributes'] = np.full(n, '', dtype=object)
     
         if self.factor:
-            factors =  self.data[self.factor].fillna(1)
+            arrays['factors'] = data[self.factor].fillna(1).to_numpy(dtype=float)
         else:
-            factors = np.full(len(vals), 1)
+            arrays['factors'] = np.ones(n)
             
         if self.offset:
-            offsets = self.data[self.offset].fillna(0)
+            arrays['offsets'] = data[self.offset].fillna(0).to_numpy(dtype=float)
         else:
-            offsets = np.zeros(len(vals))
-
+            arrays['offsets'] = np.zeros(n)
         
-        return elements, attributes, vals, factors, offsets, valid_val
+        # The formatted text of a copy is reused, if its elements and attributes are unchanged
+        inherited = self.__dict__.pop('_inherited', None)
+        if (inherited is not None
+                and np.array_equal(inherited['elements'], arrays['elements'])
+                and np.array_equal(inherited['attributes'], arrays['attributes'])):
+            arrays['bad_heads'] = inherited['bad_heads']
+            arrays['heads_tails'] = inherited['heads_tails']
+        else:
+            arrays['bad_heads'] = [f'! Bad value for {e}[{a}]: ' for e, a in zip(arrays['elements'], arrays['attributes'])]
+            # Formatted command prefixes and suffixes, by format string. See _heads_tails
+            arrays['heads_tails'] = {}
+            
+        self.__dict__['_cache'] = arrays
+        return arrays
+        
+    def evaluate(self, pvdata):
+        """
+        Extract values from pvdata, which can be a dict-like of pvname:value,
+        or a sequence of values ordered as .pvlist.
+        
+        Returns numpy arrays:
+            elements, attributes, vals, factors, offsets, valid_val
+            
+        where vals are floats, with missing values as NaN.
+        
+        The pvlist, element, attribute, factor and offset columns are read from .data
+        once and cached, also for as_bmad and as_tao. After modifying .data in place
+        (for example dm.data.loc[i, 'factor'] = 2), call .invalidate(), otherwise
+        the old columns are used. Assigning a new .data does not need it.
+        """        
+        arrays = self._arrays()
+        
+        if hasattr(pvdata, 'get'):
+            vals = list(map(pvdata.get, arrays['pvlist']))
+        else:
+            vals = pvdata
+            if len(vals) != len(arrays['pvlist']):
+                raise ValueError(f'Expected {len(arrays["pvlist"])} values, got {len(vals)}')
+        vals = values_as_float(vals)
+        
+        # Only set valid_val values
+        valid_val = ~np.isnan(vals)
+        
+        return arrays['elements'], arrays['attributes'], vals, arrays['factors'], arrays['offsets'], valid_val
         
 
     def output_str(self, element, attribute, value, factor, offset, valid_val, x_format):
         """
         Output formatted string, including additional factor and offset.
+        
+        Kept for compatibility: as_bmad and as_tao format all rows at once with emit_lines,
+        writing factor*value + offset as a number.
         """
         if not valid_val:
             return f'! Bad value for {element}[{attribute}]: {value}'
@@ -107,40 +169,75 @@ class TabularDataMap:
         
         return x_format.format(element=element, attribute=attribute, value=val)
     
+    def _heads_tails(self, x_format):
+        """
+        Returns the lists of command text before and after {value}, 
+        formatted for each row with x_format.
+        """
+        arrays = self._arrays()
+        cache = arrays['heads_tails']
+        if x_format not in cache:
+            head, _, tail = x_format.partition('{value}')
+            rows = list(zip(arrays['elements'], arrays['attributes']))
+            heads = [head.format(element=e, attribute=a) for e, a in rows]
+            tails = [tail.format(element=e, attribute=a) for e, a in rows]
+            cache[x_format] = (heads, tails)
+        return cache[x_format]
+    
+    def _lines(self, pvdata, x_format):
+        _, _, vals, factors, offsets, valid_val = self.evaluate(pvdata)
+        heads, tails = self._heads_tails(x_format)
+        values = factors * vals + offsets
+        arrays = self._arrays()
+        bad = np.flatnonzero(~valid_val)
+        bad_values = raw_values(pvdata, arrays['pvlist'], bad) if len(bad) else None
+        return emit_lines(heads, values, tails, valid_val, arrays['bad_heads'], bad_values=bad_values)
+    
     def as_bmad(self, pvdata):
         """
         Return a list of strings to be read by Bmad's parser
-        """
-        result = self.evaluate(pvdata)
         
-        f = lambda x: self.output_str( *x, self.bmad_format)
-                
-        lines = [f(x) for x in zip(*result)]
-
-        return lines
+        Values are computed as factor*value + offset.
+        """
+        return self._lines(pvdata, self.bmad_format)
     
     def as_tao(self, pvdata):
         """
-        Return a list of strings to be read by Bmad's parser
+        Return a list of Tao command strings
+        
+        Values are computed as factor*value + offset.
+        """
+        return self._lines(pvdata, self.tao_format)
+    
+    def as_bmad_text(self, pvdata):
         """
-        result = self.evaluate(pvdata)
+        Same as as_bmad, but returns a single newline-joined string.
+        """
+        return '\n'.join(self.as_bmad(pvdata))
+    
+    def as_tao_text(self, pvdata):
+        """
+        Same as as_tao, but returns a single newline-joined string.
+        """
+        return '\n'.join(self.as_tao(pvdata))
+    
+    def copy(self):
+        """
+        Returns a new TabularDataMap with its own copy of .data
         
-        f = lambda x: self.output_str( *x, self.tao_format)
-                
-        lines = [f(x) for x in zip(*result)]
-
-        return lines    
+        With pandas Copy-on-Write, .data is only copied when either datamap modifies it.
+        """
+        new = dataclasses.replace(self, data=lazy_copy(self.data))
+        arrays = self.__dict__.get('_cache', self.__dict__.get('_inherited'))
+        if arrays is not None:
+            new.__dict__['_inherited'] = arrays
+        return new
     
     def to_json(self, file=None):
         """
         Returns a JSON string
         """
-        d = {}
-        for k, v in self.__dict__.items():
-            if k == 'data':
-                d[k] = v.to_json()
-            else:
-                d[k] = v
+        d = self.asdict()
         s = json.dumps(d)
         
         if file:
@@ -152,6 +249,8 @@ class TabularDataMap:
     def asdict(self):
         d = {}
         for k, v in self.__dict__.items():
+            if k.startswith('_'):
+                continue
             if k == 'data':
                 d[k] = v.to_json()
             else:
@@ -162,14 +261,229 @@ class TabularDataMap:
     @classmethod
     def from_json(cls, s):
         """
-        Creates a new TablularDataMap from a JSON string
+        Creates a new TablularDataMap from a JSON string,
+        a JSON file, or a compiled .npz file (see to_npz).
         """
+        if isinstance(s, str) and s.endswith('.npz') and os.path.exists(s):
+            return cls.from_npz(s)
         if os.path.exists(s):
             d = json.load(open(s))
         else:
             d = json.loads(s)
-        data = pd.read_json(d.pop('data'))
+        data = pd.read_json(StringIO(d.pop('data')))
         return cls(data=data, **d)
+
+    def to_npz(self, file):
+        """
+        Writes a compiled, columnar .npz file that can be loaded
+        without any JSON parsing.
+        """
+        layouts, pools = pack_dataframes({'data': self.data})
+        params = {k: v for k, v in self.asdict().items() if k != 'data'}
+        meta = {'params': params, 'layout': layouts['data']}
+        np.savez(file, __meta__=np.array(json.dumps(meta)), **pools)
+
+    @classmethod
+    def from_npz(cls, file):
+        """
+        Creates a new TabularDataMap from a .npz file written by to_npz
+        """
+        with np.load(file, allow_pickle=False) as npz:
+            pools = {k: npz[k] for k in npz.files}
+        meta = json.loads(pools.pop('__meta__').item())
+        data = unpack_dataframes({'data': meta['layout']}, pools)['data']
+        return cls(data=data, **meta['params'])
+
+
+# Fields that _arrays depends on
+_ARRAY_FIELDS = {'data', 'pvname', 'element', 'attribute', 'factor', 'offset'}
+
+_PANDAS_3 = int(pd.__version__.split('.')[0]) >= 3
+
+
+def lazy_copy(df):
+    """
+    Returns a copy of a DataFrame. With pandas Copy-on-Write (always on from pandas 3),
+    this is a shallow copy, and data is only copied when either frame is modified.
+    """
+    if _PANDAS_3 or _option('mode.copy_on_write') is True:
+        return df.copy(deep=False)
+    return df.copy()
+
+
+def _option(name):
+    try:
+        return pd.get_option(name)
+    except KeyError:
+        return None
+
+
+def emit_lines(heads, values, tails, valid, bad_heads, integer=None, bad_values=None):
+    """
+    Formats command lines in bulk: heads[i] + value + tails[i]
+    where valid, otherwise bad_heads[i] + value.
+    
+    Parameters
+    ----------
+    heads, tails, bad_heads : list of str
+        Pre-formatted text around each value
+    values : np.ndarray of float
+    valid : np.ndarray of bool
+    integer : list of int, optional
+        Indices of values to format as integers
+    bad_values : dict of int:value, optional
+        Original PV values of invalid rows (such as None for a missing PV),
+        written in their 'Bad value' lines instead of NaN
+        
+    Returns
+    -------
+    list of str
+    """
+    values = values.tolist()
+    if integer:
+        for i in integer:
+            values[i] = int(values[i])
+    # repr gives the shortest round-trip representation of a float
+    strs = list(map(repr, values))
+    lines = list(map(str.__add__, heads, strs))
+    if any(tails):
+        lines = list(map(str.__add__, lines, tails))
+    for i in np.flatnonzero(~np.asarray(valid)):
+        if bad_values is not None and i in bad_values:
+            lines[i] = f'{bad_heads[i]}{bad_values[i]}'
+        else:
+            lines[i] = bad_heads[i] + strs[i]
+    return lines
+
+
+def raw_values(pvdata, pvlist, indices):
+    """
+    Returns a dict of i:value of the original PV values at indices of pvlist,
+    from pvdata as a dict-like of pvname:value or a sequence ordered as pvlist.
+    """
+    if hasattr(pvdata, 'get'):
+        return {i: pvdata.get(pvlist[i]) for i in indices}
+    return {i: pvdata[i] for i in indices}
+
+
+def values_as_float(values):
+    """
+    Converts a sequence of PV values to a float array, with NaN
+    for missing (None) or non-numeric values.
+    """
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([_as_float(x) for x in values], dtype=float)
+
+
+def _as_float(x):
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def pack_dataframes(frames):
+    """
+    Packs DataFrames into a few typed numpy arrays ("pools"), suitable for
+    np.savez without pickling. Columns of the same kind share a pool:
+        'f': floats, 'i': integers, 'b': booleans and null masks,
+        'U': all strings, as a single NUL-separated UTF-8 byte array
+
+    Parameters
+    ----------
+    frames : dict of key:pd.DataFrame
+
+    Returns
+    -------
+    layouts : dict of key:layout
+        JSON-serializable layout of each frame, for unpack_dataframes
+    pools : dict of kind:np.ndarray
+    """
+    pools = {}
+    sizes = {}
+
+    def put(values):
+        kind = values.dtype.kind
+        if kind == 'u':
+            kind = 'i'
+        start = sizes.get(kind, 0)
+        pools.setdefault(kind, []).append(values)
+        sizes[kind] = start + len(values)
+        return [kind, start, start + len(values)]
+
+    layouts = {}
+    for key, df in frames.items():
+        columns = []
+        for col in df.columns:
+            ser = df[col]
+            if pd.api.types.is_numeric_dtype(ser.dtype) or pd.api.types.is_bool_dtype(ser.dtype):
+                columns.append([col, put(ser.to_numpy()), None])
+            else:
+                null = ser.isnull().to_numpy()
+                # Object arrays go to the string pool
+                values = np.array([str(x) for x in ser.where(~null, '')], dtype=object)
+                columns.append([col, put(values), put(null) if null.any() else None])
+        if df.index.equals(pd.RangeIndex(len(df))):
+            index = None
+        else:
+            index = put(df.index.to_numpy())
+        layouts[key] = {'index': index, 'columns': columns}
+
+    strings = [x for arr in pools.pop('O', []) for x in arr]
+    if any('\0' in x for x in strings):
+        raise ValueError('Strings containing NUL cannot be packed')
+    pools = {kind: np.concatenate(arrays) for kind, arrays in pools.items()}
+    pools['U'] = np.frombuffer('\0'.join(strings).encode('utf-8'), dtype=np.uint8)
+    return layouts, pools
+
+
+def unpack_columns(layouts, pools):
+    """
+    Inverse of pack_dataframes, without building DataFrames.
+
+    pools must be a dict of kind:np.ndarray (read once from an NpzFile).
+
+    Returns
+    -------
+    dict of key:(columns, index)
+        columns is a dict of column name:array, index is an array or None
+    """
+    pools = dict(pools)
+    # Strings are converted to pandas' string array once, and sliced for each column
+    pools['O'] = pd.Series(pools.pop('U').tobytes().decode('utf-8').split('\0')).array
+
+    def get(ref):
+        kind, start, stop = ref
+        return pools[kind][start:stop]
+
+    unpacked = {}
+    for key, layout in layouts.items():
+        data = {}
+        for col, ref, null_ref in layout['columns']:
+            values = get(ref)
+            if null_ref:
+                values = values.copy()
+                values[get(null_ref)] = np.nan
+            data[col] = values
+        index = get(layout['index']) if layout['index'] else None
+        unpacked[key] = (data, index)
+    return unpacked
+
+
+def unpack_dataframes(layouts, pools):
+    """
+    Inverse of pack_dataframes.
+
+    pools must be a dict of kind:np.ndarray (read once from an NpzFile).
+
+    Returns
+    -------
+    dict of key:pd.DataFrame
+    """
+    return {key: pd.DataFrame(data, index=index, copy=False)
+            for key, (data, index) in unpack_columns(layouts, pools).items()}
     
     
 def datamap_from_tao_data(tao, d2, d1, tao_factor = 1.0, pv_attribute='', bmad_unit=None):
@@ -0,0 +1,202 @@
+"""
+Negative cache of dead or disconnected PVs, with exponential back-off.
+
+A PV that cannot be read costs a full Channel Access timeout on every
+request. DeadPVCache remembers such PVs so that requests can skip them,
+and re-probes them in a background thread, after base seconds, then
+base*factor, base*factor**2, ... up to max_backoff. A PV that answers
+a probe is forgotten.
+
+    cache = DeadPVCache(probe=epics.caget_many, base=10)
+    cache.record_failure('KLYS:LI20:11:SWRD')
+    'KLYS:LI20:11:SWRD' in cache     # True, until it answers a probe
+    print(cache.summary())
+
+"""
+import atexit
+import threading
+import time
+import warnings
+
+
+class DeadPVCache:
+    """
+    Set of dead PVs, with retry times growing exponentially with failures.
+
+    Parameters
+    ----------
+    probe : callable, optional
+        probe(pvnames) returns a list of values, with None for PVs that are still dead.
+        With a probe, dead PVs are re-probed in a background thread when due.
+
+    base : float, optional
+        Seconds before the first re-probe. Default: 10
+
+    factor : float, optional
+        Back-off factor for each further failure. Default: 2
+
+    max_backoff : float, optional
+        Longest time in seconds between re-probes. Default: 600
+
+    on_recover : callable, optional
+        on_recover(pvname, value) is called for each PV that answers a probe.
+
+    thread_init : callable, optional
+        Called at the start of the background thread. For pyepics probes, this is
+        epics.ca.use_initial_context, so that probes use the main Channel Access context.
+
+    The background thread is stopped at interpreter exit, before pyepics finalizes
+    Channel Access.
+
+    """
+    def __init__(self, probe=None, base=10.0, factor=2.0, max_backoff=600.0, on_recover=None,
+                 thread_init=None):
+        self.probe = probe
+        self.base = base
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.on_recover = on_recover
+        self.thread_init = thread_init
+
+        # pvname:number of consecutive failures, and time.monotonic() of next probe
+        self.failures = {}
+        self.retry_time = {}
+
+        self.n_probes = 0
+        self.n_recovered = 0
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __contains__(self, pvname):
+        return pvname in self.failures
+
+    def __len__(self):
+        return len(self.failures)
+
+    def __iter__(self):
+        return iter(list(self.failures))
+
+    def backoff(self, n_failures):
+        """
+        Seconds before the next probe, after n_failures consecutive failures.
+        """
+        return min(self.base * self.factor**(n_failures - 1), self.max_backoff)
+
+    def record_failure(self, pvname, now=None):
+        """
+        Records a failed read of pvname. Returns True if pvname is newly dead.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            n = self.failures.get(pvname, 0) + 1
+            self.failures[pvname] = n
+            self.retry_time[pvname] = now + self.backoff(n)
+            if self.probe is not None and self._thread is None:
+                self._start()
+        self._wake.set()
+        return n == 1
+
+    def record_success(self, pvname):
+        """
+        Forgets pvname. Returns True if it was dead.
+        """
+        with self._lock:
+            self.retry_time.pop(pvname, None)
+            return self.failures.pop(pvname, None) is not None
+
+    def alive(self, pvnames):
+        """
+        Returns the list of pvnames that are not dead.
+        """
+        failures = self.failures
+        if not failures:
+            return list(pvnames)
+        return [pvname for pvname in pvnames if pvname not in failures]
+
+    def due(self, now=None):
+        """
+        Returns the list of dead PVs due for a probe.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return [pvname for pvname, t in self.retry_time.items() if t <= now]
+
+    def probe_due(self, now=None):
+        """
+        Probes the PVs due, now, in the calling thread. Returns the list of recovered PVs.
+        """
+        pvnames = self.due(now=now)
+        if not pvnames:
+            return []
+        self.n_probes += 1
+        try:
+            values = self.probe(pvnames)
+        except Exception as ex:
+            # The PVs stay dead, and back off further
+            warnings.warn(f'Probe of {len(pvnames)} dead PVs failed: {ex}', RuntimeWarning)
+            values = [None] * len(pvnames)
+        recovered = []
+        for pvname, value in zip(pvnames, values):
+            if value is None:
+                self.record_failure(pvname)
+            elif self.record_success(pvname):
+                recovered.append(pvname)
+                if self.on_recover:
+                    self.on_recover(pvname, value)
+        self.n_recovered += len(recovered)
+        return recovered
+
+    def _start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='DeadPVCache', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        if self.thread_init is not None:
+            self.thread_init()
+        while not self._stop.is_set():
+            with self._lock:
+                next_time = min(self.retry_time.values(), default=None)
+            timeout = self.max_backoff if next_time is None else max(next_time - time.monotonic(), 0)
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            # PVs due shortly are probed together
+            self.probe_due(now=time.monotonic() + 0.1 * self.base)
+
+    def stop(self):
+        """
+        Stops background probing.
+        """
+        self._stop.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            atexit.unregister(self.stop)
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def clear(self):
+        with self._lock:
+            self.failures.clear()
+            self.retry_time.clear()
+
+    def summary(self):
+        """
+        Returns a text table of dead PVs, with their failures and time to the next probe.
+        """
+        now = time.monotonic()
+        with self._lock:
+            rows = sorted(self.failures.items(), key=lambda item: -item[1])
+            lines = [f'{len(rows)} dead PVs']
+            for pvname, n in rows:
+                lines.append(f'{pvname:40} {n:4} failures, next probe in {self.retry_time[pvname] - now:8.1f} s')
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return f'DeadPVCache with {len(self)} dead PVs, {self.n_recovered} recovered'
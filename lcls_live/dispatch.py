@@ -0,0 +1,132 @@
+"""
+In-process dispatch of PV change callbacks, for epics_proxy without EPICS.
+
+Offline PV_proxy callbacks are registered with the proxy's CallbackDispatcher.
+Puts (PV_proxy.put, epics_proxy.caput) and replayed changes (lcls_live.replay)
+notify it, and it runs the callbacks of the PV, with the same keywords
+as pyepics monitor callbacks.
+
+By default callbacks run immediately, in the notifying thread.
+With a coalescing interval, notifications are collected, and every interval
+each changed PV gets a single callback with its latest value, from a
+background thread (as pyepics runs callbacks from its own threads).
+This bounds the callback rate of bursts, for example of Klystron
+fault callbacks, which recompute all fault strings on every update.
+"""
+import threading
+import time
+
+
+class CallbackDispatcher:
+    """
+    Registry of callbacks by PV name, run on notify.
+
+    Parameters
+    ----------
+    interval : float, optional
+        Coalescing interval in seconds. Default: None, run callbacks on every notify.
+
+    Attributes
+    ----------
+    n_notified : int
+        Number of notifications
+
+    n_dispatched : int
+        Number of notifications dispatched to callbacks.
+        The others were coalesced, or had no callbacks.
+
+    Example
+    -------
+        dispatcher = CallbackDispatcher(interval=0.1)
+        index = dispatcher.add_callback('KLYS:LI24:11:SWRD', print)
+        dispatcher.notify('KLYS:LI24:11:SWRD', 8)
+        dispatcher.flush()
+
+    """
+    def __init__(self, interval=None):
+        self.interval = interval
+
+        # pvname:{index:(callback, kwargs)}
+        self.callbacks = {}
+        self._next_index = 0
+
+        # pvname:(value, timestamp) of coalesced notifications
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.n_notified = 0
+        self.n_dispatched = 0
+
+    def add_callback(self, pvname, callback, **kwargs):
+        """
+        Adds a callback for pvname, called as
+            callback(pvname=, value=, timestamp=, **kwargs)
+        Returns its index, for remove_callback.
+        """
+        with self._lock:
+            self._next_index += 1
+            self.callbacks.setdefault(pvname, {})[self._next_index] = (callback, kwargs)
+            return self._next_index
+
+    def remove_callback(self, pvname, index):
+        with self._lock:
+            self.callbacks.get(pvname, {}).pop(index, None)
+
+    def notify(self, pvname, value, timestamp=None):
+        """
+        Notifies a change of pvname to value.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self.n_notified += 1
+        if not self.interval:
+            self._dispatch(pvname, value, timestamp)
+            return
+        with self._lock:
+            self._pending[pvname] = (value, timestamp)
+            if self._thread is None:
+                self._start()
+
+    def _dispatch(self, pvname, value, timestamp):
+        callbacks = self.callbacks.get(pvname)
+        if not callbacks:
+            return
+        self.n_dispatched += 1
+        for callback, kwargs in list(callbacks.values()):
+            callback(pvname=pvname, value=value, timestamp=timestamp, **kwargs)
+
+    def flush(self):
+        """
+        Runs the callbacks of all coalesced notifications now.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for pvname, (value, timestamp) in pending.items():
+            self._dispatch(pvname, value, timestamp)
+
+    def _start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='CallbackDispatcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        """
+        Stops the coalescing thread, after running all pending callbacks.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        self.flush()
+
+    def __str__(self):
+        n = sum(len(c) for c in self.callbacks.values())
+        return (f'CallbackDispatcher with {n} callbacks on {len(self.callbacks)} PVs: '
+                f'{self.n_notified} notified, {self.n_dispatched} dispatched')
@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 
 from lcls_live.tools import NpEncoder
+from lcls_live.snapshot import save_snapshot, load_snapshot
+from lcls_live.journal import JournalRecorder
+from lcls_live.dispatch import CallbackDispatcher
+from lcls_live.store import PVStore
+from lcls_live.deadpv import DeadPVCache
 
 import numpy as np
+import asyncio
 import json
 import os
 import sys
+import time
 
 from math import pi, sqrt, cos, sin
 from typing import List
@@ -26,20 +33,57 @@ class epics_proxy(object):
     """
     EPICS proxy. This can be intialized from a JSON file 'file'.
     
+    With subscribe=True, every PV requested through caget_many or caget_dict 
+    gets a monitor once. Monitor callbacks write values into .pvdata, with the 
+    time received in .timestamps, and values are then served from memory 
+    while they are younger than max_age seconds. Older values are 
+    fetched again over the network. max_age=None serves monitored values 
+    for as long as their channel is connected.
     
+    .pvdata is a PVStore (see lcls_live.store), safe for monitor callbacks 
+    writing from pyepics threads. Use .pvdata.snapshot() for a consistent
+    view of all values. Assigning a dict to .pvdata replaces its values.
+    
+    Without EPICS, callbacks of PV objects (see .PV) are run by .dispatcher 
+    on puts and replayed changes. With coalesce in seconds, bursts of changes
+    run one callback per PV per coalesce interval (see lcls_live.dispatch).
+    
+    PVs that cannot be read are recorded in .dead (see lcls_live.deadpv), 
+    and skipped by caget_many and refresh, which serve their cached values.
+    They are re-probed in the background after dead_backoff seconds, 
+    doubling with each failure up to dead_max_backoff. 
+    dead_backoff=None disables this. See print(proxy.dead.summary()).
     
     """
-    def __init__(self, filename=None, epics=None, verbose=False):
+    def __init__(self, filename=None, epics=None, verbose=False, subscribe=False, max_age=None, 
+                 coalesce=None, dead_backoff=10.0, dead_max_backoff=600.0):
         
         self.filename = filename
         self.epics = epics
         self.verbose=verbose
+        self.subscribe = subscribe
+        self.max_age = max_age
             
         # Internal data
-        self.pvdata = {}
+        self._pvdata = PVStore()
         
-        # Monitors
+        # Monitors, and time.monotonic() of the last value received for each PV
         self.monitor = {}
+        self.timestamps = {}
+        # PVs with monitors that write into .pvdata
+        self.monitored = set()
+        
+        # Offline callbacks
+        self.dispatcher = CallbackDispatcher(interval=coalesce)
+        
+        # Dead PVs
+        self.dead_backoff = dead_backoff
+        self.dead = DeadPVCache(probe=self._probe_dead if epics else None, 
+                                base=dead_backoff or 0, max_backoff=dead_max_backoff,
+                                on_recover=self._dead_recovered,
+                                thread_init=getattr(getattr(epics, 'ca', None), 'use_initial_context', None))
+        # time.monotonic() of the first acaget_many request of PVs whose channels have not connected yet
+        self._search_start = {}
         
         if filename and os.path.exists(filename): 
             self.load()
@@ -48,20 +92,34 @@ class epics_proxy(object):
             raise 
         
             
-    def load(self, filename=None):
+    @property
+    def pvdata(self):
+        return self._pvdata
+
+    @pvdata.setter
+    def pvdata(self, pvdata):
+        # Keep the same store, which PV objects refer to
+        if pvdata is not self._pvdata:
+            self._pvdata.replace(pvdata)
+            
+    def load(self, filename=None, mmap=False):
+        """
+        Loads PV data from a snapshot file into .pvdata. 
+        
+        The format is chosen by extension: .npz for binary snapshots 
+        (see lcls_live.snapshot), otherwise JSON.
+        With mmap=True, waveforms of .npz snapshots are memory-mapped.
+        """
         if not filename:
             fname = self.filename
         else:
             fname = filename
 
-        with open(fname, 'r') as f:
-            data = f.read()
-
-        if not data:
-            self.vrpint(f"Unable to read data from file {fname}")
-
-
-        newdat = json.loads(data)               
+        if fname.endswith('.npz'):
+            newdat = load_snapshot(fname, mmap=mmap)
+        else:
+            with open(fname, 'r') as f:
+                newdat = json.load(f)
         self.pvdata.update(newdat)
 
         self.vprint('Loaded', fname, 'with', len(list(newdat)), 'PVs')
@@ -69,34 +127,76 @@ class epics_proxy(object):
 
     def save(self, filename=None):
         """
-        Saves internal .pvdata to a JSON file. 
+        Saves internal .pvdata to a JSON file, or to a binary snapshot
+        if the filename ends with .npz
         """
         if not filename:
             fname = self.filename
         else:
             fname = filename
-        with open(fname, 'w') as f:
-            json.dump(self.pvdata, f, cls=NpEncoder, ensure_ascii=True, indent='  ')   
+        pvdata = self.pvdata.snapshot()
+        if fname.endswith('.npz'):
+            save_snapshot(pvdata, fname)
+        else:
+            with open(fname, 'w') as f:
+                json.dump(dict(pvdata), f, cls=NpEncoder, ensure_ascii=True, indent='  ')   
         self.vprint('Saved', fname)
 
+    def record(self, filename, pvnames=None, **kwargs):
+        """
+        Returns a started JournalRecorder, appending every monitored change
+        to the journal filename. See lcls_live.journal.
+
+        Example
+        -------
+            with proxy.record('machine.journal'):
+                time.sleep(3600)
+        """
+        return JournalRecorder(self, filename, pvnames=pvnames, **kwargs).start()
 
     @property
     def all_monitors_connected(self):
         return all([self.monitor[m].wait_for_connection() for m in self.monitor])
 
     def connect_monitor(self, pvname, wait=False):
-        m = self.epics.PV(pvname)
+        m = self.epics.PV(pvname, callback=self._monitor_callback,
+                          connection_callback=self._connection_callback)
         if wait:
             m.wait_for_connection()
         self.monitor[pvname] = m
+        self.monitored.add(pvname)
         return m
 
+    def _monitor_callback(self, pvname=None, value=None, **kwargs):
+        self.pvdata[pvname] = value
+        self.timestamps[pvname] = time.monotonic()
+        if pvname in self.dead:
+            self.dead.record_success(pvname)
+
+    def _connection_callback(self, pvname=None, conn=None, **kwargs):
+        # Values of disconnected PVs are stale
+        if not conn:
+            self.timestamps.pop(pvname, None)
+
+    def is_fresh(self, pvname):
+        """
+        Returns True if the cached value of pvname was received within max_age seconds.
+        With max_age=None, monitored values are fresh while their channel is connected.
+        """
+        t = self.timestamps.get(pvname)
+        if t is None:
+            return False
+        if self.max_age is None:
+            return pvname in self.monitored
+        return time.monotonic() - t <= self.max_age
+
     def connect_monitors(self, wait=False):
         for pvname in self.pvdata:
             self.connect_monitor(pvname, wait=wait)        
     
     def caput(self, pvname, value):
         self.pvdata[pvname] = value
+        self.dispatcher.notify(pvname, value)
     
     def caget(self, pvname, use_epics=True):
         if pvname not in self.pvdata:
@@ -115,17 +215,25 @@ class epics_proxy(object):
         Returns:
             List of pv values
         """
+        # Each unique PV is only requested once
+        unique = list(dict.fromkeys(pvnames))
+        if len(unique) < len(pvnames):
+            values = dict(zip(unique, self.caget_many(unique)))
+            return [values[pvname] for pvname in pvnames]
+
+        if self.epics and self.subscribe:
+            return self._caget_many_subscribed(pvnames)
+
         if self.epics:
-            pvdata = self.epics.caget_many(pvnames)
+            received = self._caget_alive(pvnames)
+            pvdata = [received.get(pvname) for pvname in pvnames]
             if any([pv is None for pv in pvdata]):
 
                 null_indices = [i for i,v in enumerate(pvdata) if check_value_none(v)]
 
                 for item in null_indices:
 
-                    self.vprint(f"Unable to collect {pvnames[item]} with caget_many. Trying individual caget with optional cache...")
-
-                    pvdata[item] = self.caget(pvnames[item], use_epics=False)
+                    pvdata[item] = self.pvdata.get(pvnames[item])
 
             return pvdata
                 
@@ -133,6 +241,184 @@ class epics_proxy(object):
         else:
             return [self.caget(n) for n in pvnames]
 
+    async def acaget_many(self, pvnames: List[str], timeout: float = 1.0):
+        """ Retrieve pv values concurrently from an asyncio event loop, within a deadline.
+
+        All channel searches and gets are issued at once. Values arrive through
+        Channel Access callbacks, which resolve futures on the event loop,
+        so other tasks run while waiting. 
+        
+        PVs are served as by caget_many: with subscribe=True, fresh monitored values 
+        come from memory and received values are written to .pvdata. Dead PVs are skipped. 
+        PVs whose channels have not connected within epics.ca.DEFAULT_CONNECTION_TIMEOUT 
+        of their first request are recorded as dead. Connected PVs that miss the deadline
+        are only missing, and are requested again on the next call.
+        Missing PVs are served from .pvdata, if cached.
+
+        Args:
+            pvnames (List[str]): List of pvnames
+            timeout (float): Deadline in seconds for the whole request
+
+        Returns:
+            values: List of pv values, with None for PVs not received before the deadline,
+                    and not cached
+            missing: List of the unique pvnames not received from EPICS, including skipped dead PVs
+        """
+        # Each unique PV is only requested once
+        unique = list(dict.fromkeys(pvnames))
+
+        if not self.epics:
+            values = {pvname: self.pvdata.get(pvname) for pvname in unique}
+            missing = [pvname for pvname in unique if values[pvname] is None]
+            return [values[pvname] for pvname in pvnames], missing
+
+        if self.subscribe:
+            self._connect_new_monitors(unique)
+            requested = [pvname for pvname in unique if not self.is_fresh(pvname)]
+        else:
+            requested = unique
+
+        now = time.monotonic()
+        received = await self._acaget_alive(requested, timeout)
+        if self.subscribe:
+            self.pvdata.update(received)
+            self.timestamps.update(dict.fromkeys(received, now))
+
+        missing = [pvname for pvname in requested if pvname not in received]
+        if missing:
+            self.vprint(f"Unable to collect {len(missing)} PVs within {timeout} s")
+
+        pvdata = self.pvdata.snapshot()
+        return [received[pvname] if pvname in received else pvdata.get(pvname) for pvname in pvnames], missing
+
+    async def _acaget_alive(self, pvnames, timeout):
+        # Async _caget_alive. Only PVs that have not connected, within the connection
+        # timeout of their first request, are recorded as dead. Slow PVs are not.
+        if not self.dead_backoff:
+            received, _ = await self._acaget(pvnames, timeout)
+            return received
+        alive = self.dead.alive(pvnames)
+        if len(alive) < len(pvnames):
+            self.vprint(f'Skipping {len(pvnames) - len(alive)} dead PVs')
+        start = time.monotonic()
+        received, unconnected = await self._acaget(alive, timeout)
+
+        now = time.monotonic()
+        connection_timeout = self.epics.ca.DEFAULT_CONNECTION_TIMEOUT
+        dead = []
+        for pvname in alive:
+            if pvname not in unconnected:
+                self._search_start.pop(pvname, None)
+            elif now - self._search_start.setdefault(pvname, start) >= connection_timeout:
+                self._search_start.pop(pvname)
+                dead.append(pvname)
+        self._record_dead(dead)
+        return received
+
+    async def _acaget(self, pvnames, timeout):
+        # Returns dict of pvname:value of the PVs received within timeout,
+        # and the set of PVs whose channels are not connected.
+        # Each connected channel gets a subscription, whose first event is its current value,
+        # and which is cleared when the value arrives.
+        if not pvnames:
+            return {}, set()
+        ca = self.epics.ca
+        ca.use_initial_context()
+        loop = asyncio.get_running_loop()
+        futures = {pvname: loop.create_future() for pvname in pvnames}
+        subscriptions = {}
+
+        def subscribe(pvname):
+            if pvname not in subscriptions and not futures[pvname].done():
+                subscriptions[pvname] = ca.create_subscription(chids[pvname], callback=on_value)
+
+        def resolve(pvname, value):
+            if not futures[pvname].done():
+                futures[pvname].set_result(value)
+            subscription = subscriptions.pop(pvname, None)
+            if subscription is not None:
+                ca.clear_subscription(subscription[2])
+
+        # Called from Channel Access threads
+        def on_connect(pvname=None, conn=None, **kwargs):
+            if conn:
+                loop.call_soon_threadsafe(subscribe, pvname)
+
+        def on_value(pvname=None, value=None, **kwargs):
+            loop.call_soon_threadsafe(resolve, pvname, value)
+
+        chids = {}
+        for pvname in pvnames:
+            chids[pvname] = ca.create_channel(pvname, connect=False, callback=on_connect)
+        ca.flush_io()
+        try:
+            await asyncio.wait(futures.values(), timeout=timeout)
+        finally:
+            for subscription in subscriptions.values():
+                ca.clear_subscription(subscription[2])
+            unconnected = set()
+            for pvname in pvnames:
+                entry = ca.get_cache(pvname)
+                if entry is None or not entry.conn:
+                    unconnected.add(pvname)
+                if entry is not None and on_connect in entry.callbacks:
+                    entry.callbacks.remove(on_connect)
+            ca.flush_io()
+
+        received = {pvname: future.result() for pvname, future in futures.items() if future.done()}
+        return received, unconnected - set(received)
+
+    def _caget_alive(self, pvnames):
+        # caget_many of the PVs that are not dead. Returns dict of pvname:value,
+        # for the PVs received, and records PVs that were not as dead.
+        if not self.dead_backoff:
+            return dict(zip(pvnames, self.epics.caget_many(pvnames)))
+        alive = self.dead.alive(pvnames)
+        if len(alive) < len(pvnames):
+            self.vprint(f'Skipping {len(pvnames) - len(alive)} dead PVs')
+        received = {}
+        for pvname, value in zip(alive, self.epics.caget_many(alive) if alive else []):
+            if value is not None:
+                received[pvname] = value
+        self._record_dead([pvname for pvname in alive if pvname not in received])
+        return received
+
+    def _record_dead(self, pvnames):
+        for pvname in pvnames:
+            if self.dead.record_failure(pvname):
+                self.vprint(f'Unable to collect {pvname}. Using cached value, if any, '
+                            f'and retrying in {self.dead_backoff} s')
+
+    def _probe_dead(self, pvnames):
+        # Called from the DeadPVCache thread
+        return self.epics.caget_many(pvnames)
+
+    def _dead_recovered(self, pvname, value):
+        # Called from the DeadPVCache thread when a dead PV answers
+        self.vprint(f'{pvname} recovered')
+        self.pvdata[pvname] = value
+        self.timestamps[pvname] = time.monotonic()
+
+    def _connect_new_monitors(self, pvnames):
+        for pvname in pvnames:
+            if pvname not in self.monitor:
+                self.connect_monitor(pvname)
+
+    def _caget_many_subscribed(self, pvnames):
+        # Monitors new PVs, and serves fresh values from memory
+        self._connect_new_monitors(pvnames)
+
+        stale = [pvname for pvname in pvnames if not self.is_fresh(pvname)]
+        if stale:
+            self.vprint(f'caget_many on {len(stale)} stale PVs')
+            now = time.monotonic()
+            received = self._caget_alive(stale)
+            self.pvdata.update(received)
+            self.timestamps.update(dict.fromkeys(received, now))
+
+        pvdata = self.pvdata.snapshot()
+        return [pvdata.get(pvname) for pvname in pvnames]
+
     def caget_dict(self, pvnames: List[str]) -> dict:
         """ Retrieve pv values and return dict of pvname:value
 
@@ -149,7 +435,7 @@ class epics_proxy(object):
 
     def PV(self, pvname, **kwargs):
         self.vprint(f'PV for {pvname}')
-        m = PV_proxy(pvname, self.pvdata, epics=self.epics, **kwargs)
+        m = PV_proxy(pvname, self.pvdata, epics=self.epics, dispatcher=self.dispatcher, **kwargs)
         self.monitor[pvname] = m
         return m
     
@@ -159,27 +445,59 @@ class epics_proxy(object):
             print(*args, **kwargs)
             
             
-    def update(self):
-        # load live values from epics
-        # From Monitors:
-        pvlist = []
+    def refresh(self, pvnames=None) -> dict:
+        """ Refreshes .pvdata from EPICS in bulk.
+
+        PVs are split into two groups:
+            monitored: monitored PVs with a fresh value (see is_fresh), 
+                       which are already in .pvdata from the monitor callbacks.
+            polled: all others, fetched with a single caget_many.
+        Polled PVs that cannot be fetched keep their previous value.
+
+        Args:
+            pvnames (List[str], optional): PVs to refresh. Default: all PVs in .pvdata
+
+        Returns:
+            dict of:
+                n_monitored, n_polled: number of PVs in each group
+                missing: list of polled PVs that could not be fetched
+                split_time: time in seconds to check which PVs are monitored and fresh.
+                            Monitored values are not read, as they are already in .pvdata.
+                polled_time: time in seconds of the caget_many of the polled PVs
+                total_time: time in seconds
+        """
         if not self.epics:
             self.vprint('Warning: no EPICS connected. Nothing to update')
-            return
-        
-        for pvname in self.pvdata:
-            if pvname in self.monitor:
-                self.pvdata[pvname] = self.monitor[pvname].get()
-            else:
-                # Collect non-monitor pvs
-                pvlist.append(pvname)
-                
-        if len(pvlist) > 0:
-            self.vprint('caget_many on', pvlist)
-            vals = self.epics.caget_many( pvlist)
-            res = dict(zip(self.attributes, vals)) 
-            self.pvdata.update(res)           
-    
+            return {}
+
+        if pvnames is None:
+            pvnames = list(self.pvdata)
+
+        t0 = time.perf_counter()
+        polled = [pvname for pvname in pvnames if not (pvname in self.monitored and self.is_fresh(pvname))]
+        t1 = time.perf_counter()
+
+        missing = []
+        if polled:
+            self.vprint(f'caget_many on {len(polled)} PVs')
+            now = time.monotonic()
+            received = self._caget_alive(polled)
+            missing = [pvname for pvname in polled if pvname not in received]
+            self.pvdata.update(received)
+            self.timestamps.update(dict.fromkeys(received, now))
+        t2 = time.perf_counter()
+
+        return dict(n_monitored=len(pvnames) - len(polled),
+                    n_polled=len(polled),
+                    missing=missing,
+                    split_time=t1 - t0,
+                    polled_time=t2 - t1,
+                    total_time=t2 - t0)
+
+    def update(self):
+        # load live values from epics
+        self.refresh()
+
     def __str__(self):
         s = 'EPICS proxy with '+str(len(self.pvdata.keys()))+' PVs'
         return s        
@@ -194,9 +512,15 @@ class PV_proxy:
         .get
         .put
         .add_callback
+        .remove_callback
+        .run_callbacks
+        
+    Without an epics source, callbacks are registered with the dispatcher
+    (see lcls_live.dispatch), and run on puts, run_callbacks, 
+    and replayed changes (see lcls_live.replay).
     """
     
-    def __init__(self, pvname, pvdata, epics=None, **kwargs):
+    def __init__(self, pvname, pvdata, epics=None, dispatcher=None, **kwargs):
         
         if epics:
             self.PV = epics.PV(pvname, **kwargs)
@@ -206,7 +530,16 @@ class PV_proxy:
         self.pvname = pvname
         self.epics=epics
         self.pvdata = pvdata
-        self.callbacks = []
+        self.dispatcher = dispatcher or CallbackDispatcher()
+        if not epics and kwargs.get('callback'):
+            self.add_callback(kwargs['callback'])
+            
+    @property
+    def callbacks(self):
+        # index:(callback, kwargs), as in epics.PV.callbacks
+        if self.PV:
+            return self.PV.callbacks
+        return self.dispatcher.callbacks.get(self.pvname, {})
         
     def get(self, **kwargs):
         if self.PV:
@@ -218,13 +551,30 @@ class PV_proxy:
         if self.PV:
             self.PV.put(value, **kwargs)         
         self.pvdata[self.pvname] = value       
+        if not self.PV:
+            self.dispatcher.notify(self.pvname, value)
         
-    def add_callback(self, *args, **kwargs):
+    def add_callback(self, callback, **kwargs):
+        """
+        Adds a callback, called as callback(pvname=, value=, timestamp=, **kwargs).
+        Returns its index, for remove_callback.
+        """
         if self.PV:
-            self.PV.add_callback(*args, **kwargs)
-        else:
-            pass
-            # TODO
+            return self.PV.add_callback(callback, **kwargs)
+        return self.dispatcher.add_callback(self.pvname, callback, **kwargs)
+        
+    def remove_callback(self, index):
+        if self.PV:
+            return self.PV.remove_callback(index)
+        self.dispatcher.remove_callback(self.pvname, index)
+        
+    def run_callbacks(self, timestamp=None):
+        """
+        Runs all callbacks with the current value in .pvdata
+        """
+        if self.PV:
+            return self.PV.run_callbacks()
+        self.dispatcher.notify(self.pvname, self.pvdata.get(self.pvname), timestamp=timestamp)
         
 
 def linac_line(name, energy, phase_deg, fudge=None):
@@ -0,0 +1,172 @@
+"""
+Persistent local cache of archiver PV histories.
+
+Each PV has one uncompressed .npz file in the cache directory, holding
+its samples as columns, and the time intervals that they cover:
+
+    secs      : float64 UNIX timestamps, sorted
+    vals      : values, as numbers, strings, or rows of equal length waveforms
+    intervals : float64 (n, 2) array of [start, end] times, in which
+                all archived samples are in secs
+
+A request for [start, end] only needs the sub-intervals that are not
+covered yet, and merges them in. See ArchiverClient(cache=...).
+
+    cache = HistoryCache('~/.cache/lcls_live/archiver')
+    client = ArchiverClient(cache=cache)
+    secs, vals = client.history_arrays(pvname, start, end)   # fetched
+    secs, vals = client.history_arrays(pvname, start, end)   # from disk
+
+"""
+from urllib.parse import quote
+
+import numpy as np
+import os
+import threading
+import time
+
+
+def merge_intervals(intervals):
+    """
+    Returns sorted, non-overlapping intervals, merging those that overlap or touch.
+    """
+    merged = []
+    for start, end in sorted(map(tuple, intervals)):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def subtract_intervals(start, end, intervals):
+    """
+    Returns the sub-intervals of [start, end] not covered by intervals (merged and sorted).
+    """
+    gaps = []
+    t = start
+    for a, b in intervals:
+        if b < t:
+            continue
+        if a >= end:
+            break
+        if a > t:
+            gaps.append((t, a))
+        t = max(t, b)
+    if t < end:
+        gaps.append((t, end))
+    return gaps
+
+
+class HistoryCache:
+    """
+    Directory of cached PV histories.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory, created if needed.
+
+    settle : float, optional
+        Seconds before now in which data is not considered final. Samples
+        newer than this are returned but not marked as covered, so they
+        are fetched again next time. Default: 600
+
+    """
+    def __init__(self, directory, settle=600.0):
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.settle = settle
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.n_hits = 0
+        self.n_fetches = 0
+
+    def filename(self, pvname):
+        return os.path.join(self.directory, quote(pvname, safe='') + '.npz')
+
+    def load(self, pvname):
+        """
+        Returns secs, vals, intervals of pvname. Empty if it is not cached.
+        """
+        filename = self.filename(pvname)
+        if not os.path.exists(filename):
+            return np.zeros(0), np.zeros(0), []
+        with np.load(filename, allow_pickle=False) as npz:
+            return npz['secs'], npz['vals'], npz['intervals'].tolist()
+
+    def save(self, pvname, secs, vals, intervals):
+        """
+        Writes the history of pvname, atomically. Returns False if vals cannot be stored.
+        """
+        if vals.dtype == object:
+            return False
+        filename = self.filename(pvname)
+        tmp = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+        np.savez(tmp, secs=secs, vals=vals, intervals=np.array(intervals, dtype=np.float64).reshape(-1, 2))
+        os.replace(tmp, filename)
+        return True
+
+    def missing(self, pvname, start, end):
+        """
+        Returns the list of (start, end) sub-intervals of [start, end] not covered for pvname.
+        """
+        return subtract_intervals(start, end, self.load(pvname)[2])
+
+    def add(self, pvname, secs, vals, start, end):
+        """
+        Merges samples fetched for [start, end] into the cache.
+        Returns False if they could not be stored.
+        """
+        vals = np.asarray(vals)
+        if vals.dtype == object:
+            # Waveforms of equal lengths are stored as rows
+            try:
+                vals = np.stack(vals) if len(vals) else np.zeros(0)
+            except ValueError:
+                return False
+        # The last sample before start is also known to be followed by no other
+        if len(secs) and secs[0] < start:
+            start = secs[0]
+        end = min(end, time.time() - self.settle)
+
+        with self._lock:
+            old_secs, old_vals, intervals = self.load(pvname)
+            if len(old_secs):
+                all_secs = np.concatenate([old_secs, secs])
+                try:
+                    all_vals = np.concatenate([old_vals, vals])
+                except ValueError:
+                    return False
+                # Sort, keeping the newest copy of duplicate samples
+                order = np.argsort(all_secs, kind='stable')[::-1]
+                all_secs, unique = np.unique(all_secs[order], return_index=True)
+                secs, vals = all_secs, all_vals[order][unique]
+            if end > start:
+                intervals = merge_intervals(intervals + [[start, end]])
+            return self.save(pvname, secs, vals, intervals)
+
+    def get(self, pvname, start, end):
+        """
+        Returns cached secs, vals of pvname in [start, end], with
+        the last sample before start, as the archiver does.
+        """
+        secs, vals, _ = self.load(pvname)
+        i0 = max(np.searchsorted(secs, start, side='left') - 1, 0)
+        i1 = np.searchsorted(secs, end, side='right')
+        return secs[i0:i1], vals[i0:i1]
+
+    def clear(self, pvname=None):
+        """
+        Removes the history of pvname, or of all PVs.
+        """
+        names = [self.filename(pvname)] if pvname else [
+            os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith('.npz')]
+        for filename in names:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def __str__(self):
+        n = len([f for f in os.listdir(self.directory) if f.endswith('.npz')])
+        return f'History cache in {self.directory} with {n} PVs: {self.n_hits} hits, {self.n_fetches} fetches'
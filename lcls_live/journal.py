@@ -0,0 +1,351 @@
+"""
+Append-only journals of PV changes.
+
+A JournalRecorder attaches to epics_proxy monitors and appends every change,
+as (timestamp, pv_index, value), to a binary journal file, with periodic
+keyframes of the full .pvdata. Changes are queued by the monitor callbacks
+and written in batches by a background thread.
+
+File format: the 8 byte MAGIC, followed by frames of
+
+    kind    : 1 byte, one of b'N', b'C', b'K'
+    length  : uint32, little-endian, length of the payload
+    payload :
+        b'N' (names)     : uint32 index of the first new PV, then the new
+                           PV names as NUL-separated UTF-8.
+        b'C' (changes),
+        b'K' (keyframe)  : uint32 length of a JSON header, the JSON header,
+                           then an aligned byte array of sections (see lcls_live.snapshot):
+                               t  : float64 timestamp of each change, from the monitor
+                                    callback, or time.time() if it has none
+                               pv : uint32 index of each PV, in order of first appearance
+                               and the value sections of each value.
+
+A keyframe holds the full state at its time. A journal cut short (for example,
+by a crash) is readable up to its last complete frame.
+
+Values that cannot be stored (see lcls_live.snapshot.check_value) are skipped
+with a warning, and the rest of their batch is written.
+"""
+from lcls_live.snapshot import value_sections, join_sections, split_sections, section_values, check_value
+
+import numpy as np
+import collections
+import json
+import struct
+import threading
+import time
+import warnings
+
+MAGIC = b'LCLSJRN1'
+_FRAME = struct.Struct('<cI')
+_UINT32 = struct.Struct('<I')
+
+Frame = collections.namedtuple('Frame', ['kind', 't', 'pv', 'values'])
+
+
+def _encode_values(t, pv, values):
+    # Payload of a changes or keyframe frame
+    sections, n_strings = value_sections(values)
+    sections['t'] = np.asarray(t, dtype=np.float64)
+    sections['pv'] = np.asarray(pv, dtype=np.uint32)
+    layout, data = join_sections(sections)
+    header = json.dumps({'layout': layout, 'n_strings': n_strings}).encode()
+    return _UINT32.pack(len(header)) + header + data.tobytes()
+
+
+def _decode_values(payload):
+    n = _UINT32.unpack_from(payload)[0]
+    header = json.loads(payload[4:4 + n])
+    data = np.frombuffer(payload, dtype=np.uint8, offset=4 + n)
+    arrays = split_sections(header['layout'], data)
+    return arrays['t'], arrays['pv'], section_values(arrays, header['n_strings'])
+
+
+class JournalRecorder:
+    """
+    Records changes of epics_proxy monitored PVs to a journal file.
+
+    Parameters
+    ----------
+    proxy : epics_proxy
+        Proxy whose monitors are recorded
+
+    filename : str
+        Journal file. New frames are appended to an existing journal.
+
+    pvnames : list of str, optional
+        PVs to record. Monitors are connected for any that are not monitored.
+        Default: all PVs in proxy.monitor
+
+    keyframe_interval : float, optional
+        Seconds between keyframes of the full proxy.pvdata. Default: 60
+
+    flush_interval : float, optional
+        Seconds between batched writes. Default: 0.5
+
+    Example
+    -------
+        with JournalRecorder(proxy, 'machine.journal', proxy.pvdata):
+            time.sleep(3600)
+
+    """
+    def __init__(self, proxy, filename, pvnames=None, keyframe_interval=60.0, flush_interval=0.5):
+        self.proxy = proxy
+        self.filename = filename
+        self.pvnames = list(proxy.monitor if pvnames is None else pvnames)
+        self.keyframe_interval = keyframe_interval
+        self.flush_interval = flush_interval
+
+        # PV indices in this journal
+        self.pvlist = []
+        self._index = {}
+
+        # pvname:callback index
+        self._callbacks = {}
+        self._queue = collections.deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._last_keyframe = None
+
+        # Statistics
+        self.n_changes = 0
+        self.n_keyframes = 0
+        self.n_bytes = 0
+
+    def on_change(self, pvname=None, value=None, timestamp=None, **kwargs):
+        """
+        Monitor callback. Queues the change, at the monitor's timestamp,
+        for the writer thread.
+        """
+        # deque.append is thread-safe
+        self._queue.append((timestamp or time.time(), pvname, value))
+
+    def start(self):
+        """
+        Connects callbacks, writes a keyframe, and starts the writer thread.
+        """
+        self._file = open(self.filename, 'ab')
+        if self._file.tell() == 0:
+            self._write(MAGIC)
+        else:
+            # Continue the indices of an existing journal, after its last complete frame
+            journal = JournalReader(self.filename)
+            self._file.truncate(journal.size)
+            self.pvlist = list(journal.pvlist)
+            self._index = {pvname: i for i, pvname in enumerate(self.pvlist)}
+
+        for pvname in self.pvnames:
+            monitor = self.proxy.monitor.get(pvname)
+            if monitor is None:
+                monitor = self.proxy.connect_monitor(pvname)
+            self._callbacks[pvname] = monitor.add_callback(self.on_change)
+
+        self.write_keyframe()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='JournalRecorder', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Disconnects callbacks, writes all queued changes, and closes the journal.
+        """
+        for pvname, index in self._callbacks.items():
+            monitor = self.proxy.monitor.get(pvname)
+            if monitor is not None:
+                monitor.remove_callback(index)
+        self._callbacks = {}
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        if self._file is None:
+            self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            # An error must not stop the recording
+            try:
+                self.flush()
+                if time.time() - self._last_keyframe >= self.keyframe_interval:
+                    self.write_keyframe()
+            except Exception as ex:
+                warnings.warn(f'JournalRecorder failed to write {self.filename}: {ex!r}', RuntimeWarning)
+
+    def _write(self, data):
+        self._file.write(data)
+        self.n_bytes += len(data)
+
+    def _write_frame(self, kind, payload):
+        self._write(_FRAME.pack(kind, len(payload)) + payload)
+
+    def _indices(self, pvnames):
+        # Indices of pvnames, writing a names frame for new PVs
+        new = [pvname for pvname in dict.fromkeys(pvnames) if pvname not in self._index]
+        if new:
+            start = len(self.pvlist)
+            for pvname in new:
+                self._index[pvname] = len(self.pvlist)
+                self.pvlist.append(pvname)
+            self._write_frame(b'N', _UINT32.pack(start) + '\0'.join(new).encode('utf-8'))
+        return [self._index[pvname] for pvname in pvnames]
+
+    def _storable(self, t, pvnames, values):
+        # Drops values that cannot be stored, with a warning
+        keep = []
+        for i, (pvname, value) in enumerate(zip(pvnames, values)):
+            try:
+                check_value(value)
+            except ValueError:
+                warnings.warn(f'JournalRecorder skipped a value of {pvname} that cannot be stored: {value!r}',
+                              RuntimeWarning)
+            else:
+                keep.append(i)
+        if len(keep) == len(values):
+            return t, pvnames, values
+        return [t[i] for i in keep], [pvnames[i] for i in keep], [values[i] for i in keep]
+
+    def flush(self):
+        """
+        Writes all queued changes as a single frame.
+        """
+        n = len(self._queue)
+        if n == 0:
+            return
+        changes = [self._queue.popleft() for _ in range(n)]
+        t, pvnames, values = self._storable(*zip(*changes))
+        if not values:
+            return
+        pv = self._indices(pvnames)
+        self._write_frame(b'C', _encode_values(t, pv, list(values)))
+        self._file.flush()
+        self.n_changes += len(values)
+
+    def write_keyframe(self):
+        """
+        Writes the full proxy.pvdata as a keyframe.
+        """
+        # dict.copy is atomic, while callbacks may be updating pvdata
+        pvdata = self.proxy.pvdata.copy()
+        t = time.time()
+        _, pvnames, values = self._storable([t] * len(pvdata), list(pvdata), list(pvdata.values()))
+        pv = self._indices(pvnames)
+        self._write_frame(b'K', _encode_values([t] * len(pv), pv, list(values)))
+        self._file.flush()
+        self._last_keyframe = t
+        self.n_keyframes += 1
+
+    def __str__(self):
+        return (f'Journal {self.filename}: {len(self.pvlist)} PVs, {self.n_changes} changes, '
+                f'{self.n_keyframes} keyframes, {self.n_bytes} bytes written')
+
+
+class JournalReader:
+    """
+    Reads a journal written by JournalRecorder.
+
+    Attributes
+    ----------
+    pvlist : list of str
+        PV names, by index
+
+    frames : list of Frame
+        Frame(kind, t, pv, values) for each changes ('changes')
+        and keyframe ('keyframe') frame, in order.
+        t and pv are arrays, and values is a list.
+
+    Example
+    -------
+        journal = JournalReader('machine.journal')
+        for t, pvname, value in journal.events():
+            ...
+        pvdata = journal.state_at(t)
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.pvlist = []
+        self.frames = []
+        self.truncated = False
+        # Bytes up to the end of the last complete frame
+        self.size = 0
+
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'Not a journal file: {filename}')
+
+        pos = len(MAGIC)
+        while pos < len(data):
+            if pos + _FRAME.size > len(data):
+                self.truncated = True
+                break
+            kind, length = _FRAME.unpack_from(data, pos)
+            start = pos + _FRAME.size
+            if start + length > len(data):
+                self.truncated = True
+                break
+            payload = data[start:start + length]
+            pos = start + length
+
+            if kind == b'N':
+                first = _UINT32.unpack_from(payload)[0]
+                names = payload[4:].decode('utf-8').split('\0')
+                del self.pvlist[first:]
+                self.pvlist.extend(names)
+            elif kind in (b'C', b'K'):
+                t, pv, values = _decode_values(payload)
+                self.frames.append(Frame('keyframe' if kind == b'K' else 'changes', t, pv, values))
+            else:
+                raise ValueError(f'Unknown frame kind {kind} in {filename}')
+        self.size = pos
+
+    @property
+    def t_start(self):
+        return min((f.t[0] for f in self.frames if len(f.t)), default=None)
+
+    @property
+    def t_end(self):
+        return max((f.t[-1] for f in self.frames if len(f.t)), default=None)
+
+    def keyframes(self):
+        return [f for f in self.frames if f.kind == 'keyframe']
+
+    def events(self, keyframes=False):
+        """
+        Yields (t, pvname, value) for every change, in order.
+        With keyframes=True, keyframe values are included.
+        """
+        for frame in self.frames:
+            if frame.kind == 'keyframe' and not keyframes:
+                continue
+            for t, i, value in zip(frame.t.tolist(), frame.pv.tolist(), frame.values):
+                yield t, self.pvlist[i], value
+
+    def state_at(self, t):
+        """
+        Returns the dict of pvname:value at time t, from the last keyframe
+        before t and the changes after it.
+        """
+        start = 0
+        for i, frame in enumerate(self.frames):
+            if frame.kind == 'keyframe' and len(frame.t) and frame.t[0] <= t:
+                start = i
+        pvdata = {}
+        for frame in self.frames[start:]:
+            for ti, i, value in zip(frame.t.tolist(), frame.pv.tolist(), frame.values):
+                if ti > t:
+                    return pvdata
+                pvdata[self.pvlist[i]] = value
+        return pvdata
@@ -79,7 +79,7 @@ class Klystron(Device):
     #Define whether the station is available to be used
     def is_usable(self):
         #If there are none of the station's faults are in the unusable_faults list, return true.
-        return set(self.faults).isdisjoint(unusable_faults)
+        return words_are_usable(swrd=self.swrd, stat=self.stat, hdsc=self.hdsc, dsta=self.dsta)
     
 
     def deact(self, beamcode=None):
@@ -94,10 +94,22 @@ class Klystron(Device):
             if self.triggers_callback:
                 self.triggers_callback(self.sector, self.station, self.acc_trigger_status)
     def recalcFaults(self):
-        self.faults = all_fault_strings(swrd=self.swrd, stat=self.stat, hdsc=self.hdsc, dsta=self.dsta)
+        # Fault strings are decoded on demand, see .faults
+        self._faults = None
         if self.faults_callback:
             self.faults_callback(self.sector, self.station, self.faults)
 
+    @property
+    def faults(self):
+        # List of fault strings, ordered by priority. For display.
+        if self._faults is None:
+            self._faults = all_fault_strings(swrd=self.swrd, stat=self.stat, hdsc=self.hdsc, dsta=self.dsta)
+        return self._faults
+
+    @faults.setter
+    def faults(self, faults):
+        self._faults = faults
+
     # Set
     def set_acc_triggers(self, value, beamcode=None):
         if beamcode is None:
@@ -304,6 +316,29 @@ unusable_faults = [
     'Klystron Heater Delay',
     'VVS Voltage','Control Power']
 
+#Bitmasks of the unusable faults in each status word, for fast usability checks.
+def unusable_bitmask(fault_map, faults=unusable_faults):
+    mask = 0
+    for bit in fault_map:
+        if fault_map[bit][0] in faults:
+            mask |= 1 << bit
+    return mask
+
+swrd_unusable_mask = unusable_bitmask(swrd_fault_map)
+stat_unusable_mask = unusable_bitmask(stat_fault_map)
+hdsc_unusable_mask = unusable_bitmask(hdsc_fault_map)
+dsta1_unusable_mask = unusable_bitmask(dsta1_fault_map)
+dsta2_unusable_mask = unusable_bitmask(dsta2_fault_map)
+
+#Input integer status words, and you'll get whether none of their faults are unusable faults.
+#Equivalent to set(all_fault_strings(...)).isdisjoint(unusable_faults)
+def words_are_usable(swrd=0, stat=0, hdsc=0, dsta=(0, 0)):
+    return (int(swrd) & swrd_unusable_mask) == 0 \
+        and (int(stat) & stat_unusable_mask) == 0 \
+        and (int(hdsc) & hdsc_unusable_mask) == 0 \
+        and (int(dsta[0]) & dsta1_unusable_mask) == 0 \
+        and (int(dsta[1]) & dsta2_unusable_mask) == 0
+
 #Input an integer, and you'll get a list of fault strings, ordered by priority.
 def swrd_fault_strings(swrd):
     return strings_from_fault_tuple_list(swrd_faults(swrd))
@@ -0,0 +1,309 @@
+"""
+Local Channel Access server for epics_proxy snapshots, built on caproto.
+
+Serves every PV of a snapshot (for example docs/examples/data/epics_snapshot_*.json),
+with optional per-PV latency, jitter and disconnects, so that clients such as
+get-lcls-live --source epics, and epics_proxy monitors, can be tested
+without access to the accelerator network.
+
+Example, from a shell:
+
+    lcls-live-pvserver snapshot.json --latency 0.01 --jitter 0.005 --disconnect-rate 0.01
+
+and in another shell:
+
+    export EPICS_CA_AUTO_ADDR_LIST=NO EPICS_CA_ADDR_LIST=127.0.0.1
+    get-lcls-live --beampath cu_hxr --source epics --tao
+
+Requires caproto 1.3, which is an optional dependency:
+
+    pip install lcls-live[pvserver]
+
+SnapshotCircuit overrides VirtualCircuit._command_queue_iteration, and reads
+circuit.channels_sid. SnapshotContext overrides Context._subscription_queue_send,
+and reads Context.subscriptions. These are caproto internals. Check them when
+changing the caproto version pinned in setup.py.
+"""
+from lcls_live.epics import epics_proxy
+
+try:
+    from caproto import ServerDisconnResponse, ReadNotifyRequest, ReadRequest
+    from caproto import ChannelDouble, ChannelInteger, ChannelString
+    from caproto.asyncio.server import Context, VirtualCircuit
+except ImportError as ex:
+    raise ImportError('lcls_live.pvserver requires caproto. Install it with: '
+                      'pip install lcls-live[pvserver]') from ex
+
+if not (hasattr(VirtualCircuit, '_command_queue_iteration') and hasattr(Context, '_subscription_queue_send')):
+    import caproto
+    raise ImportError(f'lcls_live.pvserver does not support caproto {caproto.__version__}. '
+                      'Install it with: pip install lcls-live[pvserver]')
+
+import numpy as np
+import asyncio
+import argparse
+import time
+
+# Largest magnitude served as an integer. CA integers (DBR_LONG) are 32-bit.
+MAX_INT = 2**31 - 1
+
+
+def channel_data(value):
+    """
+    Returns caproto ChannelData for a snapshot value, or None if it cannot be served.
+
+    Floats and waveforms are served as DOUBLE, integers as LONG, strings as STRING.
+    """
+    if isinstance(value, str):
+        return ChannelString(value=value)
+    if isinstance(value, (bool, np.bool_)):
+        return ChannelInteger(value=int(value))
+    if isinstance(value, (int, np.integer)) and abs(value) <= MAX_INT:
+        return ChannelInteger(value=int(value))
+    if isinstance(value, (int, float, np.number)):
+        return ChannelDouble(value=float(value))
+    if isinstance(value, (list, tuple, np.ndarray)) and len(value) > 0:
+        try:
+            arr = np.asarray(value)
+        except ValueError:
+            return None
+        if arr.ndim != 1:
+            return None
+        if arr.dtype.kind in 'iub' and np.all(np.abs(arr) <= MAX_INT):
+            return ChannelInteger(value=arr.astype(int).tolist(), max_length=len(arr))
+        if arr.dtype.kind in 'iuf':
+            return ChannelDouble(value=arr.astype(float).tolist(), max_length=len(arr))
+    return None
+
+
+class SnapshotCircuit(VirtualCircuit):
+    """
+    Virtual circuit that answers reads after each PV's delay, concurrently,
+    and never answers reads of disconnected PVs.
+    """
+    async def _command_queue_iteration(self, command):
+        if isinstance(command, (ReadNotifyRequest, ReadRequest)):
+            chan = self.circuit.channels_sid.get(command.sid)
+            server = self.context.server
+            if chan is not None and chan.name in server.offline:
+                self.circuit.process_command(command)
+                return None
+            delay = server.delay(chan.name) if chan is not None else 0
+            if delay > 0:
+                task = asyncio.get_running_loop().create_task(self._delayed_read(command, delay))
+                server.tasks.add(task)
+                task.add_done_callback(server.tasks.discard)
+                return None
+        return await super()._command_queue_iteration(command)
+
+    async def _delayed_read(self, command, delay):
+        await asyncio.sleep(delay)
+        response = await super()._command_queue_iteration(command)
+        if response is not None:
+            await self.send(*response)
+
+
+class SnapshotContext(Context):
+    """
+    Server context that sends each monitor update, including the first value
+    of a new subscription, after the PV's delay, concurrently.
+    """
+    CircuitClass = SnapshotCircuit
+
+    def __init__(self, server, pvdb, interfaces=None):
+        super().__init__(pvdb, interfaces=interfaces)
+        self.server = server
+
+    async def _subscription_queue_send(self, sub_spec, sub, metadata, values, flags):
+        delay = self.server.delay(sub.channel.name)
+        if delay > 0:
+            task = asyncio.get_running_loop().create_task(
+                self._delayed_send(delay, sub_spec, sub, metadata, values, flags))
+            self.server.tasks.add(task)
+            task.add_done_callback(self.server.tasks.discard)
+            return
+        await super()._subscription_queue_send(sub_spec, sub, metadata, values, flags)
+
+    async def _delayed_send(self, delay, sub_spec, sub, metadata, values, flags):
+        await asyncio.sleep(delay)
+        # The subscription may have been cancelled meanwhile
+        if sub in self.subscriptions.get(sub_spec, ()):
+            await super()._subscription_queue_send(sub_spec, sub, metadata, values, flags)
+
+
+class SnapshotServer:
+    """
+    Channel Access server for a dict of pvname:value.
+
+    Parameters
+    ----------
+    pvdata : dict
+        PV values to serve, as in epics_proxy.pvdata.
+        Values that cannot be served (None, nested lists) are skipped.
+
+    latency : float or dict of pvname:float, optional
+        Delay in seconds before answering each read, and before sending
+        each monitor update, including the first value of a subscription. Default: 0
+
+    jitter : float or dict of pvname:float, optional
+        Additional random delay, uniform in [0, jitter) seconds. Default: 0
+        With jitter, monitor updates of a PV can arrive out of order.
+
+    disconnect_rate : float or dict of pvname:float, optional
+        Rate, per PV per second, of random disconnects. Default: 0
+
+    disconnect_duration : float, optional
+        Time in seconds that a randomly disconnected PV stays offline. Default: 1
+
+    interfaces : list of str, optional
+        Network interfaces to serve on. Default: ['127.0.0.1']
+
+    seed : int, optional
+        Seed for the random number generator
+
+    Disconnected PVs are not found by searches, their open channels
+    are closed, and reads in flight are never answered.
+    See also disconnect and reconnect.
+
+    The server port is set by the environmental variable EPICS_CA_SERVER_PORT
+    (default 5064).
+    """
+    def __init__(self, pvdata, latency=0.0, jitter=0.0, disconnect_rate=0.0, disconnect_duration=1.0,
+                 interfaces=None, seed=None, tick=0.1):
+
+        self.pvdb = {}
+        self.skipped = []
+        for pvname, value in pvdata.items():
+            data = channel_data(value)
+            if data is None:
+                self.skipped.append(pvname)
+            else:
+                self.pvdb[pvname] = data
+        self.pvlist = list(self.pvdb)
+
+        self.latency = latency
+        self.jitter = jitter
+        self.disconnect_rate = disconnect_rate
+        self.disconnect_duration = disconnect_duration
+        self.interfaces = interfaces or ['127.0.0.1']
+        self.tick = tick
+        self.rng = np.random.default_rng(seed)
+
+        # pvname:ChannelData of disconnected PVs, and when they reconnect
+        self.offline = {}
+        self.reconnect_time = {}
+
+        self.context = None
+        self.tasks = set()
+
+    @classmethod
+    def from_file(cls, filename, **kwargs):
+        """
+        Creates a server for an epics_proxy snapshot file
+        """
+        return cls(epics_proxy(filename=filename).pvdata, **kwargs)
+
+    def _per_pv(self, x, pvname):
+        if isinstance(x, dict):
+            return x.get(pvname, 0.0)
+        return x
+
+    def delay(self, pvname):
+        """
+        Returns the delay in seconds to answer a read, or send a monitor update, of pvname
+        """
+        delay = self._per_pv(self.latency, pvname)
+        jitter = self._per_pv(self.jitter, pvname)
+        if jitter:
+            delay += jitter * self.rng.random()
+        return delay
+
+    async def disconnect(self, pvnames, duration=None):
+        """
+        Takes PVs offline, closing their open channels.
+        With a duration in seconds, they reconnect automatically after it.
+        """
+        for pvname in pvnames:
+            if pvname in self.pvdb:
+                self.offline[pvname] = self.pvdb.pop(pvname)
+            if duration is not None and pvname in self.offline:
+                self.reconnect_time[pvname] = time.monotonic() + duration
+
+        names = set(pvnames)
+        for circuit in list(self.context.circuits if self.context else []):
+            closed = [chan.cid for chan in circuit.circuit.channels.values() if chan.name in names]
+            for cid in closed:
+                try:
+                    await circuit.send(ServerDisconnResponse(cid=cid))
+                except Exception:
+                    # The client may have gone
+                    pass
+
+    def reconnect(self, pvnames):
+        """
+        Brings PVs back online. Clients will find them on their next search,
+        which for libca (pyepics) clients can take about 10 seconds.
+        """
+        for pvname in pvnames:
+            if pvname in self.offline:
+                self.pvdb[pvname] = self.offline.pop(pvname)
+            self.reconnect_time.pop(pvname, None)
+
+    async def _disconnect_loop(self):
+        # Random disconnects, and scheduled reconnects, every tick
+        rates = np.array([self._per_pv(self.disconnect_rate, pvname) for pvname in self.pvlist])
+        while True:
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            self.reconnect([pvname for pvname, t in self.reconnect_time.items() if t <= now])
+
+            hits = np.flatnonzero(self.rng.random(len(rates)) < rates * self.tick)
+            if len(hits) > 0:
+                await self.disconnect([self.pvlist[i] for i in hits if self.pvlist[i] in self.pvdb],
+                                      duration=self.disconnect_duration)
+
+    async def run(self, log_pv_names=False):
+        """
+        Serves until cancelled.
+        """
+        self.context = SnapshotContext(self, self.pvdb, interfaces=self.interfaces)
+        rates = self.disconnect_rate.values() if isinstance(self.disconnect_rate, dict) else [self.disconnect_rate]
+        if any(rate > 0 for rate in rates):
+            task = asyncio.get_running_loop().create_task(self._disconnect_loop())
+            self.tasks.add(task)
+        await self.context.run(log_pv_names=log_pv_names)
+
+    def __str__(self):
+        return f'Snapshot server with {len(self.pvdb)} PVs online, {len(self.offline)} offline'
+
+
+parser = argparse.ArgumentParser(description="Serve an epics_proxy snapshot over Channel Access.")
+parser.add_argument("filename", type=str, help="Snapshot file, as written by epics_proxy.save")
+parser.add_argument("--latency", type=float, default=0.0, help="Delay in seconds before answering each read or monitor update.")
+parser.add_argument("--jitter", type=float, default=0.0, help="Additional random delay in seconds, uniform in [0, jitter).")
+parser.add_argument("--disconnect-rate", dest="disconnect_rate", type=float, default=0.0, help="Random disconnects per PV per second.")
+parser.add_argument("--disconnect-duration", dest="disconnect_duration", type=float, default=1.0, help="Seconds that a disconnected PV stays offline.")
+parser.add_argument("--interfaces", type=str, nargs="+", default=["127.0.0.1"], help="Network interfaces to serve on.")
+parser.add_argument("--seed", type=int, default=None, help="Random seed.")
+
+
+def main():
+    args = parser.parse_args()
+    server = SnapshotServer.from_file(args.filename,
+                                      latency=args.latency,
+                                      jitter=args.jitter,
+                                      disconnect_rate=args.disconnect_rate,
+                                      disconnect_duration=args.disconnect_duration,
+                                      interfaces=args.interfaces,
+                                      seed=args.seed)
+    print(server)
+    if server.skipped:
+        print(f'Skipped {len(server.skipped)} PVs that cannot be served')
+    try:
+        asyncio.run(server.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
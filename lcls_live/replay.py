@@ -0,0 +1,271 @@
+"""
+Replay of recorded PV data into an epics_proxy.
+
+A Replay reads a journal (see lcls_live.journal) or a sequence of snapshots,
+and drives the proxy's .pvdata and PV_proxy callbacks with the recorded changes,
+at wall-clock speed, N times faster, or as fast as possible.
+This reproduces realistic event rates offline, for example for the
+datamap-to-Tao pipeline or klystron fault callbacks:
+
+    proxy = epics_proxy(filename='snapshot.json')
+    klys = Klystron(sector=24, station=1, epics=proxy)
+    klys.connect_monitors()          # callbacks on PV_proxy objects
+    replay = Replay(proxy, 'machine.journal', speed=10)
+    replay.run()
+
+"""
+from lcls_live.journal import JournalReader
+from lcls_live.snapshot import load_snapshot
+
+import numpy as np
+import json
+import threading
+import time
+
+
+def _load_pvdata(snapshot):
+    # dict of pvname:value from a dict, or a .npz or JSON snapshot file
+    if isinstance(snapshot, dict):
+        return snapshot
+    if snapshot.endswith('.npz'):
+        return load_snapshot(snapshot)
+    with open(snapshot) as f:
+        return json.load(f)
+
+
+def _same(a, b):
+    if isinstance(a, (list, tuple, np.ndarray)) or isinstance(b, (list, tuple, np.ndarray)):
+        try:
+            return np.array_equal(a, b, equal_nan=True)
+        except TypeError:
+            return np.array_equal(a, b)
+    if isinstance(a, float) and isinstance(b, float) and a != a and b != b:
+        return True
+    return a == b
+
+
+def snapshot_changes(snapshots, interval=1.0):
+    """
+    Returns the initial state and changes of a sequence of snapshots.
+
+    Parameters
+    ----------
+    snapshots : list
+        Snapshots as filenames (.npz or JSON) or dicts of pvname:value,
+        or as (t, snapshot) pairs with t in seconds.
+
+    interval : float, optional
+        Seconds between snapshots given without times. Default: 1
+
+    Returns
+    -------
+    pvdata : dict
+        The first snapshot
+
+    t_start : float
+        Its time
+
+    changes : generator of (t, pvname, value)
+        The values that differ from the previous snapshot, at each snapshot time
+    """
+    snapshots = [s if isinstance(s, tuple) else (i * interval, s) for i, s in enumerate(snapshots)]
+    t_start, first = snapshots[0]
+    pvdata = dict(_load_pvdata(first))
+
+    def changes():
+        last = dict(pvdata)
+        for t, snapshot in snapshots[1:]:
+            # Snapshots are loaded as they are reached
+            for pvname, value in _load_pvdata(snapshot).items():
+                if pvname not in last or not _same(last[pvname], value):
+                    last[pvname] = value
+                    yield t, pvname, value
+
+    return pvdata, t_start, changes()
+
+
+def journal_changes(journal, start=None):
+    """
+    Returns the initial state and changes of a journal, as in snapshot_changes.
+
+    journal can be a filename or a JournalReader.
+    Changes are replayed from start (default: the start of the journal),
+    from the state at that time.
+    Values of keyframes that differ from the replayed state, for example
+    changes that were not monitored, are replayed at the keyframe time.
+    """
+    if not isinstance(journal, JournalReader):
+        journal = JournalReader(journal)
+    t_start = journal.t_start if start is None else start
+    pvdata = journal.state_at(t_start)
+
+    def changes():
+        pvlist = journal.pvlist
+        last = dict(pvdata)
+        for frame in journal.frames:
+            if not len(frame.t) or frame.t[-1] <= t_start:
+                continue
+            keyframe = frame.kind == 'keyframe'
+            for t, i, value in zip(frame.t.tolist(), frame.pv.tolist(), frame.values):
+                if t <= t_start:
+                    continue
+                pvname = pvlist[i]
+                # Keyframes mostly repeat values already replayed
+                if keyframe and pvname in last and _same(last[pvname], value):
+                    continue
+                last[pvname] = value
+                yield t, pvname, value
+
+    return pvdata, t_start, changes()
+
+
+class Replay:
+    """
+    Replays recorded PV changes into an epics_proxy.
+
+    Parameters
+    ----------
+    proxy : epics_proxy
+        Proxy to drive. Its .pvdata is updated with each change, and
+        its dispatcher runs the callbacks of its PV objects (see epics_proxy.PV).
+        With epics_proxy(coalesce=...), bursts of changes are coalesced.
+
+    source : str, JournalReader, or list
+        A journal filename or JournalReader, or a list of snapshots
+        as accepted by snapshot_changes.
+
+    speed : float, optional
+        Replay speed relative to the recording. Default: 1, wall-clock speed.
+        None replays as fast as possible.
+
+    interval : float, optional
+        Seconds between snapshots given without times. Default: 1
+
+    start : float, optional
+        Journal time to start from. Default: the start of the journal
+
+    Attributes
+    ----------
+    t : float
+        Recorded time of the last change replayed
+
+    n_events : int
+        Number of changes replayed
+
+    max_lag : float
+        Largest delay, in wall-clock seconds, of a change behind its schedule.
+        Callbacks that cannot keep up with the event rate show up here.
+
+    Example
+    -------
+        replay = Replay(proxy, ['a.json', 'b.json', 'c.json'], interval=60, speed=60)
+        replay.start()   # in a background thread
+        ...
+        replay.stop()
+
+    """
+    def __init__(self, proxy, source, speed=1.0, interval=1.0, start=None):
+        self.proxy = proxy
+        self.speed = speed
+
+        if isinstance(source, (list, tuple)):
+            pvdata, self.t_start, self._changes = snapshot_changes(source, interval=interval)
+        else:
+            pvdata, self.t_start, self._changes = journal_changes(source, start=start)
+
+        # The initial state is loaded without callbacks, as by epics_proxy.load
+        self.proxy.pvdata.update(pvdata)
+        self.t = self.t_start
+
+        self.n_events = 0
+        self.max_lag = 0.0
+        self.elapsed = 0.0
+        self.done = False
+
+        # Next change, not yet replayed
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def apply(self, pvname, value, t=None):
+        """
+        Sets a value in the proxy, and notifies its dispatcher,
+        which runs the callbacks of PV_proxy objects of the PV.
+        """
+        self.proxy.pvdata[pvname] = value
+        self.proxy.timestamps[pvname] = time.monotonic()
+        self.proxy.dispatcher.notify(pvname, value, timestamp=t)
+
+    def run(self, duration=None):
+        """
+        Replays changes until the end of the recording, until stop() is called,
+        or for duration recorded seconds. Returns the number of changes replayed.
+        """
+        self._stop.clear()
+        return self._run(duration)
+
+    def _run(self, duration=None):
+        t0 = self.t
+        wall0 = time.monotonic()
+        n0 = self.n_events
+        while True:
+            if self._pending is None:
+                self._pending = next(self._changes, None)
+                if self._pending is None:
+                    self.done = True
+                    break
+            t, pvname, value = self._pending
+            if duration is not None and t - t0 > duration:
+                break
+            if self.speed:
+                wait = wall0 + (t - t0) / self.speed - time.monotonic()
+                if wait > 0:
+                    if self._stop.wait(wait):
+                        break
+                else:
+                    self.max_lag = max(self.max_lag, -wait)
+            elif self._stop.is_set():
+                break
+            self.apply(pvname, value, t=t)
+            self.t = t
+            self.n_events += 1
+            self._pending = None
+        self.elapsed += time.monotonic() - wall0
+        return self.n_events - n0
+
+    def start(self, duration=None):
+        """
+        Runs the replay in a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, kwargs={'duration': duration},
+                                        name='Replay', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops a replay running in the background.
+        """
+        self._stop.set()
+        self.wait()
+
+    def wait(self, timeout=None):
+        """
+        Waits for a replay running in the background to finish.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._thread = None
+
+    @property
+    def rate(self):
+        """
+        Changes replayed per wall-clock second
+        """
+        return self.n_events / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f'Replay at {self.speed or "full"} speed: {self.n_events} changes in '
+                f'{self.t - self.t_start:.3f} recorded s, {self.elapsed:.3f} s, max lag {self.max_lag:.4f} s')
@@ -0,0 +1,253 @@
+"""
+Binary snapshots of PV data.
+
+A snapshot is an uncompressed .npz file holding a dict of pvname:value as a few
+typed arrays, so that loading needs no text parsing. All arrays are stored as
+sections of a single byte array 'data', described by the JSON '__meta__':
+
+    names      : all PV names, as NUL-separated UTF-8 bytes
+    kind       : uint8 kind of each PV (see KINDS)
+    floats     : float64 values of the float PVs, in order
+    integers   : int64 values of the integer PVs, in order
+    bools      : uint8 values of the bool PVs, in order
+    strings    : values of the string PVs, as NUL-separated UTF-8 bytes
+    waveforms_f, waveforms_i :
+                 float64 and int64 waveforms, concatenated in order
+    waveform_length :
+                 int64 length of each waveform, in order
+    json       : other values (such as 2-d waveforms, or lists of strings),
+                 as NUL-separated JSON texts
+
+Because 'data' is stored uncompressed, it can be memory-mapped
+directly from the file. See load_snapshot.
+"""
+from lcls_live.tools import NpEncoder
+
+import numpy as np
+import json
+import zipfile
+
+# Version 1 snapshots have no json section
+SNAPSHOT_VERSION = 2
+
+# Kinds of values
+NONE, FLOAT, INT, BOOL, STRING, WAVEFORM_F, WAVEFORM_I, JSON = range(8)
+KINDS = {NONE: 'none', FLOAT: 'float', INT: 'int', BOOL: 'bool', STRING: 'string',
+         WAVEFORM_F: 'float waveform', WAVEFORM_I: 'integer waveform', JSON: 'json'}
+
+# Sections of 'data' start on multiples of this
+_ALIGN = 8
+
+
+def _kind(value):
+    if value is None:
+        return NONE
+    if isinstance(value, (bool, np.bool_)):
+        return BOOL
+    if isinstance(value, (int, np.integer)):
+        return INT if -2**63 <= value < 2**63 else FLOAT
+    if isinstance(value, (float, np.floating)):
+        return FLOAT
+    if isinstance(value, str):
+        return STRING if '\0' not in value else JSON
+    if isinstance(value, (list, tuple, np.ndarray)):
+        try:
+            arr = np.asarray(value)
+        except ValueError:
+            # Ragged nested lists
+            return JSON
+        if arr.ndim == 1 and arr.dtype.kind in 'iub':
+            return WAVEFORM_I
+        if arr.ndim == 1 and (arr.dtype.kind == 'f' or len(arr) == 0):
+            return WAVEFORM_F
+    return JSON
+
+
+def _json(value):
+    try:
+        return json.dumps(value, cls=NpEncoder)
+    except (TypeError, ValueError) as ex:
+        raise ValueError(f'Cannot store value in a snapshot: {value!r}') from ex
+
+
+def check_value(value):
+    """
+    Raises ValueError if value cannot be stored in a snapshot.
+    """
+    if _kind(value) == JSON:
+        _json(value)
+
+
+def _pack_strings(strings):
+    return np.frombuffer('\0'.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def _unpack_strings(blob, n):
+    if n == 0:
+        return []
+    return bytes(blob).decode('utf-8').split('\0')
+
+
+def value_sections(values):
+    """
+    Packs a list of values into typed arrays (the value sections described 
+    in the module docstring). Returns the dict of arrays, and the number of strings.
+    """
+    kinds = [_kind(v) for v in values]
+
+    def select(*selected):
+        return [v for v, k in zip(values, kinds) if k in selected]
+
+    waveforms_f = [np.asarray(v, dtype=np.float64) for v in select(WAVEFORM_F)]
+    waveforms_i = [np.asarray(v, dtype=np.int64) for v in select(WAVEFORM_I)]
+    strings = select(STRING)
+    texts = [_json(v) for v in select(JSON)]
+
+    sections = dict(
+        kind=np.array(kinds, dtype=np.uint8),
+        floats=np.array(select(FLOAT), dtype=np.float64),
+        integers=np.array(select(INT), dtype=np.int64),
+        bools=np.array(select(BOOL), dtype=np.uint8),
+        strings=_pack_strings(strings),
+        waveforms_f=np.concatenate(waveforms_f) if waveforms_f else np.zeros(0, dtype=np.float64),
+        waveforms_i=np.concatenate(waveforms_i) if waveforms_i else np.zeros(0, dtype=np.int64),
+        waveform_length=np.array([len(v) for v in select(WAVEFORM_F, WAVEFORM_I)], dtype=np.int64),
+        json=_pack_strings(texts),
+    )
+    return sections, len(strings)
+
+
+def join_sections(sections):
+    """
+    Joins a dict of 1-d arrays into a single aligned uint8 array.
+    Returns the layout, a dict of name:[dtype, byte offset, count], and the array.
+    """
+    layout = {}
+    chunks = []
+    offset = 0
+    for name, arr in sections.items():
+        layout[name] = [arr.dtype.str, offset, len(arr)]
+        chunk = arr.tobytes()
+        chunk += b'\0' * (-len(chunk) % _ALIGN)
+        chunks.append(chunk)
+        offset += len(chunk)
+    return layout, np.frombuffer(b''.join(chunks), dtype=np.uint8)
+
+
+def split_sections(layout, data):
+    """
+    Inverse of join_sections. Returns a dict of arrays, as views into data.
+    """
+    arrays = {}
+    for name, (dtype, offset, count) in layout.items():
+        dtype = np.dtype(dtype)
+        arrays[name] = data[offset:offset + count*dtype.itemsize].view(dtype)
+    return arrays
+
+
+def section_values(arrays, n_strings):
+    """
+    Inverse of value_sections. Returns the list of values.
+
+    Scalars are Python values, and waveforms are views into their pool.
+    JSON values are decoded by json.loads.
+    """
+    kind = np.asarray(arrays['kind'])
+    # Scalars are put in place with one assignment per kind, as Python objects
+    values = np.empty(len(kind), dtype=object)
+    values[kind == FLOAT] = arrays['floats']
+    values[kind == INT] = arrays['integers']
+    values[kind == BOOL] = arrays['bools'].astype(bool)
+    values[kind == STRING] = _unpack_strings(arrays['strings'], n_strings)
+    values = values.tolist()
+
+    # Waveforms are views into their pool, in order
+    pools = {WAVEFORM_F: arrays['waveforms_f'], WAVEFORM_I: arrays['waveforms_i']}
+    starts = {WAVEFORM_F: 0, WAVEFORM_I: 0}
+    waveform_ix = np.flatnonzero((kind == WAVEFORM_F) | (kind == WAVEFORM_I)).tolist()
+    for i, n in zip(waveform_ix, arrays['waveform_length'].tolist()):
+        k = int(kind[i])
+        values[i] = pools[k][starts[k]:starts[k] + n]
+        starts[k] += n
+
+    json_ix = np.flatnonzero(kind == JSON).tolist()
+    if json_ix:
+        texts = _unpack_strings(arrays['json'], len(json_ix))
+        for i, text in zip(json_ix, texts):
+            values[i] = json.loads(text)
+    return values
+
+
+def save_snapshot(pvdata, filename):
+    """
+    Saves a dict of pvname:value to an uncompressed .npz snapshot.
+
+    Values can be None, bool, int, float, str, or 1-d numeric sequences (waveforms).
+    Other values that can be written as JSON, such as 2-d waveforms or lists of strings,
+    are stored as JSON text.
+    """
+    names = list(pvdata)
+    sections, n_strings = value_sections(list(pvdata.values()))
+    sections['names'] = _pack_strings(names)
+    layout, data = join_sections(sections)
+
+    meta = {'version': SNAPSHOT_VERSION, 'n_pvs': len(names), 'n_strings': n_strings,
+            'layout': layout}
+    np.savez(filename, __meta__=np.array(json.dumps(meta)), data=data)
+
+
+def _npz_memmap(filename, member):
+    # Memory-maps an uncompressed .npy member of an .npz file
+    with zipfile.ZipFile(filename) as zf:
+        info = zf.getinfo(member + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f'Cannot memory-map compressed member {member} of {filename}')
+    with open(filename, 'rb') as f:
+        # Local file header: 30 bytes, then the file name and extra field
+        f.seek(info.header_offset)
+        header = f.read(30)
+        n_name = int.from_bytes(header[26:28], 'little')
+        n_extra = int.from_bytes(header[28:30], 'little')
+        f.seek(info.header_offset + 30 + n_name + n_extra)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if np.prod(shape) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def read_snapshot_arrays(filename, mmap=False):
+    """
+    Returns a dict of the arrays stored in a snapshot (see the module docstring),
+    and its metadata.
+
+    With mmap=True, arrays are views into the memory-mapped file rather than read.
+    """
+    with np.load(filename, allow_pickle=False) as npz:
+        meta = json.loads(npz['__meta__'].item())
+        if meta['version'] not in (1, SNAPSHOT_VERSION):
+            raise ValueError(f'Unknown snapshot version {meta["version"]} in {filename}')
+        if mmap:
+            data = _npz_memmap(filename, 'data')
+        else:
+            data = npz['data']
+
+    arrays = split_sections(meta['layout'], data)
+    return arrays, meta
+
+
+def load_snapshot(filename, mmap=False):
+    """
+    Loads a .npz snapshot as a dict of pvname:value.
+
+    Scalars are returned as Python values, and waveforms as numpy arrays.
+    With mmap=True, waveforms are read-only views into the memory-mapped file.
+    """
+    arrays, meta = read_snapshot_arrays(filename, mmap=mmap)
+    names = _unpack_strings(arrays['names'], meta['n_pvs'])
+    return dict(zip(names, section_values(arrays, meta['n_strings'])))
@@ -0,0 +1,136 @@
+"""
+Thread-safe store of PV values, with copy-on-write snapshots.
+
+pyepics runs monitor callbacks on its own threads, which write into
+epics_proxy.pvdata while the model thread reads it. PVStore serializes
+writers with a lock, and gives readers consistent snapshots without locks
+or copies: a snapshot is a read-only view of the current dict, and the
+next write after a snapshot copies the dict before changing it.
+A snapshot therefore never changes, and costs at most one dict copy,
+paid by the first writer after it.
+
+    pvdata = proxy.pvdata.snapshot()     # atomic machine state
+    values, valid = plan.evaluate(pvdata)
+
+"""
+from collections.abc import MutableMapping
+from types import MappingProxyType
+
+import threading
+
+
+class PVStore(MutableMapping):
+    """
+    Dict-like store of pvname:value, safe for concurrent writers.
+
+    Single reads (store[pvname], .get, in) see the latest value without locking.
+    Iteration, .keys(), .values() and .items() run over a snapshot,
+    so they never fail because of concurrent writes.
+
+    Attributes
+    ----------
+    version : int
+        Incremented by every write. Two snapshots with the same version are identical.
+
+    Example
+    -------
+        store = PVStore({'A': 1})
+        view, version = store.versioned_snapshot()
+        store['A'] = 2
+        view['A']               # still 1
+
+    """
+    def __init__(self, data=None):
+        self._data = dict(data) if data else {}
+        self._lock = threading.Lock()
+        # True while ._data is referenced by a snapshot, and must not change
+        self._shared = False
+        self.version = 0
+
+    def _writable(self):
+        # Returns ._data ready for writing. Call while holding ._lock.
+        if self._shared:
+            self._data = dict(self._data)
+            self._shared = False
+        self.version += 1
+        return self._data
+
+    def snapshot(self):
+        """
+        Returns a read-only view of all values at this time, which will not change.
+        """
+        return self.versioned_snapshot()[0]
+
+    def versioned_snapshot(self):
+        """
+        Returns a snapshot (see .snapshot) and its version.
+        """
+        with self._lock:
+            self._shared = True
+            return MappingProxyType(self._data), self.version
+
+    # Reads
+    def __getitem__(self, pvname):
+        return self._data[pvname]
+
+    def get(self, pvname, default=None):
+        return self._data.get(pvname, default)
+
+    def __contains__(self, pvname):
+        return pvname in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def keys(self):
+        return self.snapshot().keys()
+
+    def values(self):
+        return self.snapshot().values()
+
+    def items(self):
+        return self.snapshot().items()
+
+    def copy(self):
+        """
+        Returns a dict copy of all values.
+        """
+        return dict(self.snapshot())
+
+    # Writes
+    def __setitem__(self, pvname, value):
+        with self._lock:
+            self._writable()[pvname] = value
+
+    def __delitem__(self, pvname):
+        with self._lock:
+            if pvname not in self._data:
+                raise KeyError(pvname)
+            del self._writable()[pvname]
+
+    def update(self, other=(), **kwargs):
+        """
+        Writes many values at once, as a single version.
+        """
+        with self._lock:
+            data = self._writable()
+            data.update(other, **kwargs)
+
+    def replace(self, data):
+        """
+        Replaces all values.
+        """
+        data = dict(data)
+        with self._lock:
+            self._data = data
+            self._shared = False
+            self.version += 1
+
+    def clear(self):
+        self.replace({})
+
+    def __repr__(self):
+        return f'PVStore({len(self)} PVs, version {self.version})'
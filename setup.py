@@ -27,11 +27,14 @@ setup(
     long_description=open('README.md').read(),
     long_description_content_type='text/markdown',
     install_requires=requirements,
+    # The pvserver uses caproto server internals, so caproto is pinned to the versions tested
+    extras_require={'pvserver': ['caproto>=1.3,<1.4']},
     include_package_data=True,
     python_requires='>=3.6',
     entry_points={
     'console_scripts': [
-        'get-lcls-live=lcls_live.command_line:main'],
+        'get-lcls-live=lcls_live.command_line:main',
+        'lcls-live-pvserver=lcls_live.pvserver:main'],
     },
     scripts = ["scripts/configure-epics-remote", "scripts/configure-archiver-remote"]
 )
@@ -0,0 +1,60 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def ca_server(tmp_path):
+    """
+    Returns a function that starts python -m lcls_live.pvserver for a dict of pvname:value,
+    with extra command line arguments, and returns the environment for its clients.
+    """
+    pytest.importorskip('lcls_live.pvserver')
+    processes = []
+
+    def start(pvdata, *args):
+        port = str(_free_port())
+        env = dict(os.environ, EPICS_CA_SERVER_PORT=port, EPICS_CAS_SERVER_PORT=port,
+                   EPICS_CA_AUTO_ADDR_LIST='NO', EPICS_CA_ADDR_LIST='127.0.0.1',
+                   EPICS_CAS_INTF_ADDR_LIST='127.0.0.1')
+        env['PYTHONPATH'] = os.pathsep.join([os.getcwd()] + sys.path)
+        fname = tmp_path / f'snapshot_{port}.json'
+        fname.write_text(json.dumps(pvdata))
+        processes.append(subprocess.Popen([sys.executable, '-m', 'lcls_live.pvserver', str(fname), *args],
+                                          env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT))
+        # Wait for the server to listen
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            with socket.socket() as s:
+                if s.connect_ex(('127.0.0.1', int(port))) == 0:
+                    return env
+            time.sleep(0.1)
+        raise RuntimeError('pvserver did not start')
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def run_client(env, script, timeout=60):
+    """
+    Runs a client script in a new process, with the environment of a pvserver.
+    Returns its stdout.
+    """
+    pytest.importorskip('epics')
+    result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True,
+                            text=True, timeout=timeout)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
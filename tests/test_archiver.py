@@ -0,0 +1,46 @@
+import numpy as np
+
+from lcls_live.archiver import ArchiverClient, sample_arrays, stream_sample_arrays
+from lcls_live.history_cache import HistoryCache
+
+
+def samples(vals, t0=1000):
+    return [{'secs': t0 + i, 'nanos': 500_000_000, 'val': val} for i, val in enumerate(vals)]
+
+
+def test_sample_arrays_scalars():
+    secs, vals = sample_arrays(samples([1.0, 2.0, 3]))
+    assert secs.tolist() == [1000.5, 1001.5, 1002.5]
+    assert vals.dtype == np.float64
+    assert vals.tolist() == [1.0, 2.0, 3.0]
+
+
+def test_sample_arrays_waveforms():
+    secs, vals = sample_arrays(samples([[1, 2], [3, 4]]))
+    assert vals.dtype == object and vals.shape == (2,)
+    assert vals[1].tolist() == [3, 4]
+
+
+def test_sample_arrays_ragged_waveforms():
+    secs, vals = sample_arrays(samples([[1, 2], [3, 4, 5], []]))
+    assert vals.dtype == object and vals.shape == (3,)
+    assert [v.tolist() for v in vals] == [[1, 2], [3, 4, 5], []]
+
+    secs, vals = stream_sample_arrays(samples([[1.0], [2.0], [3.0, 4.0], [5.0]]), batch_size=2)
+    assert secs.tolist() == [1000.5, 1001.5, 1002.5, 1003.5]
+    assert [v.tolist() for v in vals] == [[1.0], [2.0], [3.0, 4.0], [5.0]]
+
+
+def test_cached_ragged_waveforms(tmp_path):
+    # Waveforms of varying length cannot be cached, and are fetched directly
+    client = ArchiverClient(cache=HistoryCache(tmp_path, settle=0), verbose=False)
+    fetched = []
+
+    def history_samples(pvname, start, end, verbose, stream):
+        fetched.append((start, end))
+        return samples([[1, 2], [3, 4, 5]])
+    client._history_samples = history_samples
+
+    secs, vals = client.history_arrays('X', start='1970-01-01T00:16:00Z', end='1970-01-01T00:17:00Z')
+    assert [v.tolist() for v in vals] == [[1, 2], [3, 4, 5]]
+    assert len(fetched) == 2
@@ -0,0 +1,59 @@
+import json
+from io import StringIO
+import re
+
+import pandas as pd
+import pytest
+
+from lcls_live.datamaps import bundle, master
+
+
+@pytest.fixture
+def master_file(tmp_path, monkeypatch):
+    """
+    Master file with the shipped cu_spec beampath only, used in place of the shipped one.
+    """
+    section = master.load_config('cu_spec')
+    master_file = tmp_path / 'datamaps_master.json'
+    master_file.write_text(json.dumps({'cu_spec': section}))
+
+    monkeypatch.setattr(master, 'MASTER_FILE', str(master_file))
+    monkeypatch.setattr(master, 'INDEX_FILE', str(tmp_path / 'missing_index.json'))
+    monkeypatch.setattr(master, '_INDEX', None)
+    monkeypatch.setattr(master, '_SECTIONS', {})
+    return master_file
+
+
+def test_roundtrip(master_file, tmp_path):
+    bundle.build_bundle('cu_spec', directory=tmp_path)
+    specs = bundle.load_bundle('cu_spec', directory=tmp_path)
+    raw = master.load_config('cu_spec')
+    assert [(name, cls) for name, cls, _ in specs] == [(dm['name'], dm['class']) for dm in raw]
+    for (name, cls, kwargs), dm in zip(specs, raw):
+        d = json.loads(dm['data'])
+        if cls == 'tabular':
+            expected = pd.read_json(StringIO(d.pop('data')))
+            pd.testing.assert_frame_equal(kwargs.pop('data').reset_index(drop=True),
+                                          expected.reset_index(drop=True), check_dtype=False)
+            assert kwargs == d
+
+
+def test_same_size_edit_is_stale(master_file, tmp_path, monkeypatch):
+    bundle.build_bundle('cu_spec', directory=tmp_path)
+    assert bundle.load_bundle('cu_spec', directory=tmp_path) is not None
+
+    # Change one digit: same size, same section offsets, different content
+    text = master_file.read_text()
+    i = re.search(r'\d', text[20:]).start() + 20
+    text = text[:i] + str((int(text[i]) + 1) % 10) + text[i + 1:]
+    size = master_file.stat().st_size
+    master_file.write_text(text)
+    assert master_file.stat().st_size == size
+    monkeypatch.setattr(master, '_INDEX', None)
+    monkeypatch.setattr(master, '_SECTIONS', {})
+
+    assert bundle.load_bundle('cu_spec', directory=tmp_path) is None
+
+
+def test_missing_bundle(master_file, tmp_path):
+    assert bundle.load_bundle('cu_spec', directory=tmp_path) is None
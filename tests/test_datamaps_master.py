@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from lcls_live.datamaps import master
+
+
+@pytest.fixture
+def master_file(tmp_path, monkeypatch):
+    """
+    Small master file and index, used in place of the shipped ones.
+    """
+    master_file = tmp_path / 'datamaps_master.json'
+    index_file = tmp_path / 'datamaps_master_index.json'
+    master_file.write_text(json.dumps({'a': [{'factor': 1.5}], 'b': [{'factor': 2.5}]}))
+    master.write_master_index(master_file, index_file)
+
+    monkeypatch.setattr(master, 'MASTER_FILE', str(master_file))
+    monkeypatch.setattr(master, 'INDEX_FILE', str(index_file))
+    monkeypatch.setattr(master, '_INDEX', None)
+    monkeypatch.setattr(master, '_SECTIONS', {})
+    return master_file
+
+
+def test_sections(master_file):
+    assert master.available_configs() == ['a', 'b']
+    assert master.load_config('b') == [{'factor': 2.5}]
+    assert master.load_all() == json.loads(master_file.read_text())
+
+
+def test_same_size_edit_rebuilds_index(master_file, monkeypatch):
+    # Same size, different content: the stored offsets must not be trusted
+    size = master_file.stat().st_size
+    master_file.write_text(json.dumps({'a': [{'factor': 11.5}], 'b': [{'factor': 25}]}))
+    assert master_file.stat().st_size == size
+
+    assert master.load_config('b') == [{'factor': 25}]
+    assert master.load_config('a') == [{'factor': 11.5}]
+
+
+def test_index_digest(master_file):
+    index = master.build_master_index(master_file)
+    master_file.write_text(master_file.read_text().replace('2.5', '3.5'))
+    edited = master.build_master_index(master_file)
+    assert edited['source_size'] == index['source_size']
+    assert edited['source_sha1'] != index['source_sha1']
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lcls_live.datamaps import TabularDataMap, DatamapPlan, DeltaEmitter, get_datamaps
+
+
+@pytest.fixture
+def datamap():
+    data = pd.DataFrame({'pvname': ['A', 'B', 'C'],
+                         'element': ['Q1', 'Q2', 'Q3'],
+                         'factor': [2.0, 1.0, np.nan]})
+    return TabularDataMap(data, pvname='pvname', element='element', attribute='', factor='factor')
+
+
+def test_evaluate(datamap):
+    _, _, vals, factors, offsets, valid = datamap.evaluate({'A': 1.0, 'C': 3.0})
+    np.testing.assert_array_equal(factors, [2, 1, 1])
+    np.testing.assert_array_equal(valid, [True, False, True])
+    assert datamap.as_bmad({'A': 1.0, 'B': 2.0, 'C': 3.0}) == ['Q1[] = 2.0', 'Q2[] = 2.0', 'Q3[] = 3.0']
+
+
+def test_replace_data(datamap):
+    datamap.pvlist
+    datamap.data = datamap.data.assign(pvname=['X', 'Y', 'Z'])
+    assert datamap.pvlist == ['X', 'Y', 'Z']
+    datamap.pvname = 'element'
+    assert datamap.pvlist == ['Q1', 'Q2', 'Q3']
+
+
+def test_invalidate(datamap):
+    datamap.pvlist
+    datamap.data.loc[0, 'pvname'] = 'X'
+    datamap.invalidate()
+    assert datamap.pvlist == ['X', 'B', 'C']
+
+
+def test_edit_in_place_needs_invalidate(datamap):
+    pvdata = {'A': 1.0, 'B': 2.0, 'C': 3.0}
+    assert datamap.evaluate(pvdata)[3].tolist() == [2, 1, 1]
+    # In-place edits are not detected: the cached columns are used until invalidate()
+    datamap.data.loc[1, 'factor'] = 10.0
+    assert datamap.evaluate(pvdata)[3].tolist() == [2, 1, 1]
+    assert datamap.as_bmad(pvdata)[1] == 'Q2[] = 2.0'
+    datamap.invalidate()
+    assert datamap.evaluate(pvdata)[3].tolist() == [2, 10, 1]
+    assert datamap.as_bmad(pvdata)[1] == 'Q2[] = 20.0'
+
+
+def test_copy_is_independent(datamap):
+    datamap.pvlist
+    copy = datamap.copy()
+    copy.data['pvname'] = ['X', 'Y', 'Z']
+    assert copy.pvlist == ['X', 'Y', 'Z']
+    assert datamap.pvlist == ['A', 'B', 'C']
+    assert datamap.data['pvname'].tolist() == ['A', 'B', 'C']
+
+
+def test_get_datamaps_edit():
+    # As in docs/examples: edit the columns of a cached datamap
+    dm = get_datamaps('cu_hxr')['bpms']
+    pvlist = dm.pvlist
+    dm = get_datamaps('cu_hxr')['bpms']
+    dm.data['pvname'] = [name[:-2] + 'TH' for name in dm.data['pvname']]
+    assert dm.pvlist == [name[:-2] + 'TH' for name in pvlist]
+    assert get_datamaps('cu_hxr')['bpms'].pvlist == pvlist
+
+
+def test_bad_values(datamap):
+    pvdata = {'A': 1.0, 'B': 'INVALID'}
+    expected = ['Q1[] = 2.0', '! Bad value for Q2[]: INVALID', '! Bad value for Q3[]: None']
+    assert datamap.as_bmad(pvdata) == expected
+    assert datamap.as_bmad([1.0, 'INVALID', None]) == expected
+    assert DatamapPlan([datamap]).as_bmad(pvdata) == expected
+    emitter = DeltaEmitter([datamap], cmd_type='bmad')
+    assert emitter.emit(pvdata) == expected
@@ -0,0 +1,81 @@
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+from lcls_live.deadpv import DeadPVCache
+
+
+def test_backoff():
+    cache = DeadPVCache(base=10, factor=2, max_backoff=30)
+    assert [cache.backoff(n) for n in (1, 2, 3, 4)] == [10, 20, 30, 30]
+
+    assert cache.record_failure('A', now=0)
+    assert not cache.record_failure('A', now=0)
+    assert cache.alive(['A', 'B']) == ['B']
+    assert cache.due(now=19) == []
+    assert cache.due(now=20) == ['A']
+    assert cache.record_success('A')
+    assert 'A' not in cache
+
+
+def test_probe_due():
+    recovered = {}
+    cache = DeadPVCache(probe=lambda pvnames: [1.0 if pvname == 'A' else None for pvname in pvnames],
+                        on_recover=recovered.__setitem__)
+    cache.failures.update(A=1, B=1)
+    cache.retry_time.update(A=0, B=0)
+    assert cache.probe_due(now=1) == ['A']
+    assert recovered == {'A': 1.0}
+    assert list(cache) == ['B']
+    assert cache.failures['B'] == 2
+    cache.stop()
+
+
+def test_failed_probe_warns():
+    def probe(pvnames):
+        raise OSError('no network')
+    cache = DeadPVCache(probe=probe)
+    cache.failures['A'] = 1
+    cache.retry_time['A'] = 0
+    with pytest.warns(RuntimeWarning, match='no network'):
+        assert cache.probe_due(now=1) == []
+    cache.stop()
+    assert 'A' in cache
+
+
+def test_background_thread():
+    threads = []
+    cache = DeadPVCache(probe=lambda pvnames: [1.0] * len(pvnames), base=0.01,
+                        thread_init=lambda: threads.append(threading.current_thread()))
+    cache.record_failure('A')
+    deadline = time.monotonic() + 5
+    while 'A' in cache and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert 'A' not in cache
+    assert threads and threads[0] is not threading.current_thread()
+    cache.stop()
+    assert cache._thread is None
+
+
+def test_stopped_at_exit():
+    # Handlers registered before the cache starts, such as pyepics' finalize_libca,
+    # run after its thread has stopped
+    script = textwrap.dedent("""
+        import atexit, time
+        from lcls_live.deadpv import DeadPVCache
+
+        def finalize():
+            print('running', cache._thread is not None)
+
+        atexit.register(finalize)
+        cache = DeadPVCache(probe=lambda pvnames: [None] * len(pvnames), base=0.01)
+        cache.record_failure('A')
+        time.sleep(0.1)
+        """)
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == 'running False'
@@ -0,0 +1,34 @@
+import textwrap
+
+from conftest import run_client
+
+
+def test_acaget_many_slow_pvs_are_not_dead(ca_server):
+    env = ca_server({f'T:{i}': float(i) for i in range(20)}, '--latency', '0.2')
+    script = textwrap.dedent("""
+        import asyncio, epics
+        from lcls_live.epics import epics_proxy
+        names = [f'T:{i}' for i in range(20)]
+        proxy = epics_proxy(epics=epics)
+
+        async def main():
+            # Still searching for the channels
+            _, missing = await proxy.acaget_many(names, timeout=0.01)
+            print(len(missing), len(proxy.dead))
+            # Connected, but slower than the deadline
+            await asyncio.sleep(1)
+            _, missing = await proxy.acaget_many(names, timeout=0.05)
+            print(len(missing), len(proxy.dead))
+            values, missing = await proxy.acaget_many(names, timeout=2)
+            print(len(missing), len(proxy.dead), values == [float(i) for i in range(20)])
+            # Never connects
+            await proxy.acaget_many(['T:NONE'], timeout=0.5)
+            await asyncio.sleep(epics.ca.DEFAULT_CONNECTION_TIMEOUT)
+            await proxy.acaget_many(['T:NONE'], timeout=0.5)
+            print(list(proxy.dead))
+
+        asyncio.run(main())
+        proxy.dead.stop()
+    """)
+    lines = run_client(env, script).splitlines()
+    assert lines == ['20 0', '20 0', '0 0 True', "['T:NONE']"]
@@ -0,0 +1,58 @@
+import numpy as np
+
+from lcls_live.history_cache import HistoryCache, merge_intervals, subtract_intervals
+
+
+def test_merge_intervals():
+    assert merge_intervals([]) == []
+    assert merge_intervals([[5, 6], [1, 2], [2, 3], [1.5, 2.5]]) == [[1, 3], [5, 6]]
+    assert merge_intervals([[0, 10], [2, 3]]) == [[0, 10]]
+
+
+def test_subtract_intervals():
+    assert subtract_intervals(0, 10, []) == [(0, 10)]
+    assert subtract_intervals(0, 10, [[2, 3], [5, 6]]) == [(0, 2), (3, 5), (6, 10)]
+    assert subtract_intervals(2, 6, [[0, 3], [5, 8]]) == [(3, 5)]
+    assert subtract_intervals(2, 6, [[0, 8]]) == []
+    assert subtract_intervals(0, 4, [[4, 8]]) == [(0, 4)]
+
+
+def test_add_get_missing(tmp_path):
+    cache = HistoryCache(tmp_path, settle=0)
+    assert cache.missing('X', 0, 100) == [(0, 100)]
+
+    assert cache.add('X', np.array([10.0, 20.0]), np.array([1.0, 2.0]), 10, 30)
+    assert cache.missing('X', 0, 100) == [(0, 10), (30, 100)]
+
+    # Overlapping samples are merged, keeping the newest copy of duplicates
+    assert cache.add('X', np.array([20.0, 40.0]), np.array([2.5, 4.0]), 20, 50)
+    assert cache.missing('X', 0, 100) == [(0, 10), (50, 100)]
+    secs, vals = cache.get('X', 15, 45)
+    # With the last sample before the start
+    assert secs.tolist() == [10.0, 20.0, 40.0]
+    assert vals.tolist() == [1.0, 2.5, 4.0]
+
+    # The last sample before start means there are no others since it
+    assert cache.add('X', np.array([5.0, 60.0]), np.array([0.5, 6.0]), 55, 70)
+    assert cache.missing('X', 0, 100) == [(0, 5), (70, 100)]
+
+
+def test_settle(tmp_path):
+    cache = HistoryCache(tmp_path, settle=1e12)
+    assert cache.add('X', np.array([10.0]), np.array([1.0]), 10, 30)
+    # Recent data is stored but not marked as covered
+    assert cache.missing('X', 10, 30) == [(10, 30)]
+    assert cache.get('X', 10, 30)[1].tolist() == [1.0]
+
+
+def test_waveforms(tmp_path):
+    cache = HistoryCache(tmp_path, settle=0)
+    vals = np.empty(2, dtype=object)
+    vals[:] = [np.array([1.0, 2.0]), np.array([3.0, 4.0])]
+    assert cache.add('W', np.array([1.0, 2.0]), vals, 1, 2)
+    assert cache.get('W', 1, 2)[1].tolist() == [[1.0, 2.0], [3.0, 4.0]]
+
+    ragged = np.empty(2, dtype=object)
+    ragged[:] = [np.array([1.0]), np.array([3.0, 4.0])]
+    assert not cache.add('R', np.array([1.0, 2.0]), ragged, 1, 2)
+    assert cache.missing('R', 1, 2) == [(1, 2)]
@@ -0,0 +1,70 @@
+import json
+import warnings
+
+import pytest
+
+from lcls_live.epics import epics_proxy
+from lcls_live.journal import JournalRecorder, JournalReader
+
+
+def offline_proxy(tmp_path, pvdata):
+    fname = tmp_path / 'snapshot.json'
+    fname.write_text(json.dumps(pvdata))
+    proxy = epics_proxy(filename=str(fname))
+    for pvname in pvdata:
+        proxy.PV(pvname)
+    return proxy
+
+
+def test_bad_values_are_skipped(tmp_path):
+    proxy = offline_proxy(tmp_path, {'A': 1.0, 'B': 2.0})
+    fname = tmp_path / 'test.journal'
+    recorder = JournalRecorder(proxy, fname, flush_interval=60).start()
+    proxy.monitor['A'].put(1.5)
+    proxy.monitor['B'].put([[1, 2], [3, 4]])
+    proxy.monitor['B'].put(['x', 'y'])
+    # Cannot be written as JSON
+    proxy.monitor['A'].put(object())
+    proxy.monitor['A'].put(2.5)
+    with pytest.warns(RuntimeWarning, match='skipped a value of A'):
+        recorder.stop()
+
+    journal = JournalReader(fname)
+    events = [(pvname, value) for _, pvname, value in journal.events()]
+    assert events == [('A', 1.5), ('B', [[1, 2], [3, 4]]), ('B', ['x', 'y']), ('A', 2.5)]
+    assert recorder.n_changes == 4
+
+
+def test_writer_survives_errors(tmp_path):
+    proxy = offline_proxy(tmp_path, {'A': 1.0})
+    fname = tmp_path / 'test.journal'
+    recorder = JournalRecorder(proxy, fname, flush_interval=0.01)
+    flush = recorder.flush
+    calls = []
+
+    def failing_flush():
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError('disk full')
+        flush()
+    recorder.flush = failing_flush
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        recorder.start()
+        proxy.monitor['A'].put(1.5)
+        while len(calls) < 3:
+            recorder._stop.wait(0.01)
+        assert recorder._thread.is_alive()
+        recorder.stop()
+    assert any('disk full' in str(w.message) for w in caught)
+    assert [value for _, _, value in JournalReader(fname).events()] == [1.5]
+
+
+def test_monitor_timestamp(tmp_path):
+    proxy = offline_proxy(tmp_path, {'A': 1.0})
+    fname = tmp_path / 'test.journal'
+    with JournalRecorder(proxy, fname, flush_interval=60):
+        proxy.pvdata['A'] = 3.0
+        proxy.monitor['A'].run_callbacks(timestamp=1234.5)
+    assert list(JournalReader(fname).events()) == [(1234.5, 'A', 3.0)]
@@ -0,0 +1,43 @@
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+from conftest import run_client
+
+pvserver = pytest.importorskip('lcls_live.pvserver')
+
+
+def test_channel_data():
+    assert pvserver.channel_data(1.5).value == 1.5
+    assert pvserver.channel_data(3).value == 3
+    assert pvserver.channel_data('ON').value == 'ON'
+    assert list(pvserver.channel_data(np.array([1.0, 2.0])).value) == [1.0, 2.0]
+    assert pvserver.channel_data(None) is None
+    assert pvserver.channel_data([[1, 2], [3, 4]]) is None
+
+
+def test_missing_caproto():
+    script = "import sys; sys.modules['caproto'] = None; import lcls_live.pvserver"
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=60)
+    assert result.returncode != 0
+    assert 'pip install lcls-live[pvserver]' in result.stderr
+
+
+def test_monitor_latency(ca_server):
+    # Subscriptions, as used by acaget_many, are delayed as reads are
+    env = ca_server({'T:A': 1.0, 'T:B': 2.0}, '--latency', '0.3')
+    script = textwrap.dedent("""
+        import asyncio, time, epics
+        from lcls_live.epics import epics_proxy
+        names = ['T:A', 'T:B']
+        epics.caget_many(names)
+        proxy = epics_proxy(epics=epics)
+        t = time.monotonic()
+        values, missing = asyncio.run(proxy.acaget_many(names, timeout=5))
+        print(values, missing, time.monotonic() - t)
+    """)
+    out = run_client(env, script).split()
+    assert out[:3] == ['[1.0,', '2.0]', '[]']
+    assert float(out[3]) >= 0.3
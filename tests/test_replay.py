@@ -0,0 +1,34 @@
+import json
+
+from lcls_live.epics import epics_proxy
+from lcls_live.journal import JournalRecorder, JournalReader
+from lcls_live.replay import Replay, journal_changes
+
+
+def test_keyframe_changes(tmp_path):
+    snapshot = tmp_path / 'snapshot.json'
+    snapshot.write_text(json.dumps({'A': 1.0, 'B': 2.0}))
+    proxy = epics_proxy(filename=str(snapshot))
+    proxy.PV('A')
+
+    fname = tmp_path / 'test.journal'
+    # Only A is recorded as it changes. B changes without a monitor,
+    # so its new value is only in the next keyframe.
+    with JournalRecorder(proxy, fname, pvnames=['A'], flush_interval=60) as recorder:
+        proxy.monitor['A'].put(1.5)
+        recorder.flush()
+        proxy.pvdata['B'] = 55.0
+        recorder.write_keyframe()
+
+    journal = JournalReader(fname)
+    assert [f.kind for f in journal.frames] == ['keyframe', 'changes', 'keyframe']
+    pvdata, t_start, changes = journal_changes(journal)
+    assert pvdata == {'A': 1.0, 'B': 2.0}
+    # The unchanged A of the last keyframe is not repeated
+    assert [(pvname, value) for _, pvname, value in changes] == [('A', 1.5), ('B', 55.0)]
+
+    target = epics_proxy(filename=str(snapshot))
+    replay = Replay(target, journal, speed=None)
+    replay.run()
+    assert target.pvdata['A'] == 1.5
+    assert target.pvdata['B'] == 55.0
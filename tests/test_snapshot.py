@@ -0,0 +1,43 @@
+from lcls_live.snapshot import save_snapshot, load_snapshot, value_sections, section_values
+import numpy as np
+import json
+
+
+def test_roundtrip(tmp_path):
+    pvdata = {'A': 1.5, 'B': 3, 'C': True, 'D': 'text', 'E': None,
+              'F': [1.0, 2.0], 'G': np.arange(3), 'H': [], 'I': 2**70}
+    fname = tmp_path / 'snap.npz'
+    save_snapshot(pvdata, fname)
+    loaded = load_snapshot(fname)
+    assert list(loaded) == list(pvdata)
+    for k in ['A', 'B', 'C', 'D', 'E']:
+        assert loaded[k] == pvdata[k]
+        assert type(loaded[k]) is type(pvdata[k])
+    assert loaded['F'].tolist() == [1.0, 2.0]
+    assert loaded['G'].tolist() == [0, 1, 2]
+    assert len(loaded['H']) == 0
+    assert loaded['I'] == float(2**70)
+
+
+def test_json_values(tmp_path):
+    # Values that are not scalars or 1-d numeric waveforms are stored as JSON
+    pvdata = {'W2': [[1, 2], [3, 4]], 'S': ['a', 'b'], 'R': [[1], [2, 3]],
+              'N': 'nul\0char', 'X': np.ones((2, 2)), 'A': 1.0}
+    fname = tmp_path / 'snap.npz'
+    save_snapshot(pvdata, fname)
+    loaded = load_snapshot(fname)
+    assert loaded['W2'] == [[1, 2], [3, 4]]
+    assert loaded['S'] == ['a', 'b']
+    assert loaded['R'] == [[1], [2, 3]]
+    assert loaded['N'] == 'nul\0char'
+    assert loaded['X'] == [[1.0, 1.0], [1.0, 1.0]]
+    assert loaded['A'] == 1.0
+
+
+def test_version_1_sections():
+    # Version 1 sections have no json section
+    sections, n_strings = value_sections([1.0, 'a', [1, 2]])
+    del sections['json']
+    values = section_values(sections, n_strings)
+    assert values[:2] == [1.0, 'a']
+    assert values[2].tolist() == [1, 2]